@@ -1,57 +1,3111 @@
+import time
+STARTUP_ORIGIN = time.perf_counter()
 import sys
 import os
+import argparse
+import importlib
 import numpy as np
-from scipy import signal
-from scipy.io import wavfile
-import pygame
-import rtmidi
 import json
 import random
+import hashlib
+import bisect
+import struct
+import threading
+import tracemalloc
+from collections import deque, OrderedDict
+from fractions import Fraction
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory, get_context
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QSlider, QLabel, QPushButton, QRadioButton, QGroupBox, QComboBox, 
                              QGraphicsView, QGraphicsScene, QFileDialog, QLineEdit, QSpinBox, 
-                             QProgressBar, QTabWidget, QScrollArea)
-from PyQt6.QtCore import Qt, QTimer, QRectF
-from PyQt6.QtGui import QPen, QPainterPath, QColor
+                             QProgressBar, QTabWidget, QScrollArea, QListWidget)
+from PyQt6.QtCore import Qt, QTimer, QRectF, QObject, pyqtSignal, QStringListModel
+from PyQt6.QtGui import QPen, QPainterPath, QColor, QPolygonF, QBrush
+
+
+
+class StartupReport:
+    # Czasy faz startu liczone od poczatku importu modulu, z watku GUI i z watkow w tle
+    def __init__(self, origin):
+        self.origin = origin
+        self.phases = []
+        self.lock = threading.Lock()
+
+    def add(self, name, start, end=None):
+        end = time.perf_counter() if end is None else end
+        with self.lock:
+            self.phases.append((name, threading.current_thread().name, start - self.origin, end - start))
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start)
+
+    def text(self):
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[2])
+        lines = [f"{'phase':32s} {'thread':12s} {'start':>10s} {'took':>10s}"]
+        for name, thread, start, took in phases:
+            lines.append(f"{name:32s} {thread:12s} {start * 1000:8.1f}ms {took * 1000:8.1f}ms")
+        return "\n".join(lines)
+
+
+STARTUP = StartupReport(STARTUP_ORIGIN)
+
+
+class LazyModule:
+    # Ciezkie moduly (scipy.signal ~1.5 s, pygame, rtmidi) importowane przy pierwszym uzyciu
+    # atrybutu albo wczesniej przez load() w watku startowym, rownolegle z pokazaniem okna
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    with STARTUP.phase(f"import {self._name}"):
+                        self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self.load(), attr)
+
+
+signal = LazyModule('scipy.signal')
+wavfile = LazyModule('scipy.io.wavfile')
+spatial = LazyModule('scipy.spatial')
+pygame = LazyModule('pygame')
+rtmidi = LazyModule('rtmidi')
+
+ENGINE_VERSION = 5
+SAMPLE_FORMATS = {'float32': np.float32, 'int16': np.int16}
+AUDIO_BACKENDS = ('pygame', 'null', 'file')
+AUDIO_DEFAULTS = {'backend': 'pygame', 'rate': 44100, 'block': 256, 'format': 'float32', 'path': "output.wav"}
+
+DEFAULT_PARAMS = {
+    'wave_shape1': 'sine', 'wave_shape2': 'sine', 'wave_mix': 0.5, 'frequency': 440.0,
+    'freq_mod': 0.0, 'freq_mod_rate': 0.0, 'amp_mod': 0.0, 'amp_mod_rate': 0.0,
+    'harm1_weight': 1.0, 'harm2_weight': 0.5, 'harm3_weight': 0.25, 'harm4_weight': 0.125, 'harm5_weight': 0.0625,
+    'attack_time': 0.1, 'decay_time': 0.2, 'sustain_level': 0.7, 'release_time': 0.3,
+    'vibrato_rate': 0.0, 'vibrato_depth': 0.0, 'tremolo_rate': 0.0, 'tremolo_depth': 0.0,
+    'distortion': 0.0, 'noise_level': 0.0, 'bit_crush': 0.0, 'fold_amount': 0.0,
+    'filter_cutoff': 20000, 'filter_resonance': 0.0, 'filter_mode': 'lowpass',
+    'chorus_depth': 0.0, 'chorus_rate': 0.0, 'chorus_mix': 0.5
+}
+
+
+def note_to_freq(note):
+    return 440 * (2 ** ((np.asarray(note, dtype=np.float64) - 69) / 12))
+
+
+class WavetableBank:
+    # Jednookresowe tablice ograniczone pasmowo, po jednej na oktawe (mipmapy): dla danej
+    # czestotliwosci bierzemy tablice bez harmonicznych powyzej Nyquista, wiec square/saw nie aliasuja
+    table_size = 2048
+    base_freq = 20.0
+    levels = 11
+
+    def __init__(self, sample_rate, work=None):
+        self.sample_rate = sample_rate
+        self.work = work or Workspace()
+        self.tables = {name: self._build(coeffs).astype(np.float32) for name, coeffs in {
+            'sine': lambda n: (n == 1) * 1.0,
+            'square': lambda n: (n % 2 == 1) * 4 / (np.pi * n),
+            'sawtooth': lambda n: -2 / (np.pi * n),
+            'triangle': None,
+            'custom': lambda n: (n == 1) * 0.7,
+        }.items()}
+
+    def _build(self, sine_coeffs):
+        nyquist = self.sample_rate / 2
+        tables = np.zeros((self.levels, self.table_size + 1))
+        for level in range(self.levels):
+            top = self.base_freq * 2 ** (level + 1)
+            count = int(min(nyquist / top, self.table_size // 2 - 1))
+            n = np.arange(1, count + 1)
+            spectrum = np.zeros(self.table_size // 2 + 1, dtype=complex)
+            if sine_coeffs is None:
+                # trojkat: -(8/pi^2) * suma cos(2 pi n x) / n^2 po nieparzystych n
+                spectrum[n] = (n % 2 == 1) * -8 / (np.pi * n) ** 2 * self.table_size / 2
+            else:
+                spectrum[n] = -1j * sine_coeffs(n) * self.table_size / 2
+            tables[level, :-1] = np.fft.irfft(spectrum, self.table_size)
+            tables[level, -1] = tables[level, 0]
+        return tables
+
+    def level(self, freq):
+        octave = np.floor(np.log2(np.maximum(np.abs(freq), self.base_freq) / self.base_freq))
+        return np.clip(octave, 0, self.levels - 1).astype(np.intp)
+
+    def lookup(self, name, phase, freq, out=None):
+        # Interpolacja liniowa w tablicy wybranej dla kazdej nuty (wiersza) osobno;
+        # phase musi byc juz zawinieta do [0, 1)
+        tables = self.tables[name]
+        if out is None:
+            out = np.empty(phase.shape, np.float32)
+        position = self.work.get('wt_position', phase.shape)
+        np.multiply(phase, self.table_size, out=position)
+        index = self.work.get('wt_index', phase.shape, np.intp)
+        np.copyto(index, position, casting='unsafe')
+        frac = position
+        frac -= index
+        level = self.level(freq)
+        if np.ndim(level) == 2:
+            level = level[:, :1]
+        index += level * (self.table_size + 1)
+        flat = tables.ravel()
+        low = self.work.get('wt_low', phase.shape)
+        flat.take(index, out=low)
+        index += 1
+        flat.take(index, out=out)
+        out -= low
+        out *= frac
+        out += low
+        return out
+
+
+# Filtry: sekcje drugiego rzedu (biquad) ze stanem trzymanym miedzy blokami i tryb SVF (TPT)
+FILTER_MODES = ('lowpass', 'highpass', 'bandpass', 'svf', 'svf_highpass', 'svf_bandpass', 'svf_notch')
+
+
+def resonance_to_q(resonance):
+    # 0 -> Butterworth (Q = 1/sqrt(2)), 1 -> Q ~ 12
+    return 0.7071 + 11.3 * min(max(resonance, 0.0), 1.0)
+
+
+@lru_cache(maxsize=4096)
+def filter_coefficients(mode, cutoff, q, sample_rate):
+    # Zwraca (b, a, to_df, from_df); dla SVF to_df/from_df przeliczaja stan filtra (ic1eq, ic2eq)
+    # na stan lfilter (DF-II transponowana) i z powrotem, dla biquadow sa None.
+    # 'svf' to wyjscie dolnoprzepustowe, 'svf_highpass'/'svf_bandpass'/'svf_notch' pozostale
+    cutoff = min(max(cutoff, 10.0), 0.45 * sample_rate)
+    if mode.startswith('svf'):
+        g = np.tan(np.pi * cutoff / sample_rate)
+        k = 1.0 / q
+        a1 = 1.0 / (1.0 + g * (g + k))
+        a2 = g * a1
+        a3 = g * a2
+        A = np.array([[2 * a1 - 1, -2 * a2], [2 * a2, 1 - 2 * a3]])
+        B = np.array([[2 * a2], [2 * a3]])
+        # v1 (pasmowe) i v2 (dolnoprzepustowe) jako funkcje stanu i wejscia v0
+        c_band, d_band = np.array([[a1, -a2]]), a2
+        c_low, d_low = np.array([[a2, 1 - a3]]), a3
+        output = mode[4:]
+        if output == 'highpass':
+            C, D = -k * c_band - c_low, 1 - k * d_band - d_low
+        elif output == 'bandpass':
+            # k * v1: wzmocnienie 1 w szczycie, jak biquad 'bandpass'
+            C, D = k * c_band, k * d_band
+        elif output == 'notch':
+            C, D = -k * c_band, 1 - k * d_band
+        else:
+            C, D = c_low, d_low
+        D = np.array([[D]])
+        b, a = signal.ss2tf(A, B, C, D)
+        b = b[0]
+        observe_df = np.array([[1.0, 0.0], [-a[1], 1.0]])
+        to_df = np.linalg.solve(observe_df, np.vstack([C, C @ A]))
+        return b, a, to_df, np.linalg.inv(to_df)
+
+    w0 = 2 * np.pi * cutoff / sample_rate
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    if mode == 'highpass':
+        b = np.array([(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2])
+    elif mode == 'bandpass':
+        b = np.array([alpha, 0.0, -alpha])
+    else:
+        b = np.array([(1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2])
+    a = np.array([1 + alpha, -2 * cos_w0, 1 - alpha])
+    return b / a[0], a / a[0], None, None
+
+
+@lru_cache(maxsize=4096)
+def filter_peak_gain(mode, cutoff, q, sample_rate):
+    # Szczyt |H| na siatce logarytmicznej (plus sam cutoff): rezonans przy Q ~ 12 to ok. +21.6 dB
+    b, a, _, _ = filter_coefficients(mode, cutoff, q, sample_rate)
+    freqs = np.append(np.geomspace(10.0, 0.5 * sample_rate, 2048), min(max(cutoff, 10.0), 0.45 * sample_rate))
+    _, response = signal.freqz(b, a, worN=freqs, fs=sample_rate)
+    return float(np.abs(response).max())
+
+
+def quantize_cutoff(cutoff):
+    # 1/96 oktawy: gesto dla ucha, a cache wspolczynnikow nie rosnie przy plynnej modulacji
+    return float(2 ** (np.round(np.log2(max(cutoff, 1.0)) * 96) / 96))
+
+
+class VoiceFilter:
+    # Przyczynowy filtr jednego glosu: jeden przebieg lfilter na blok, stan przechodzi do
+    # nastepnego bloku, a zmiana cutoff jest wygladzana wykladniczo (w skali logarytmicznej)
+    def __init__(self, sample_rate, smoothing=0.02):
+        self.sample_rate = sample_rate
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        self.mode = None
+        self.cutoff = None
+        self.state = np.zeros(2)
+
+    def process(self, block, mode, cutoff, resonance):
+        if mode != self.mode:
+            self.mode = mode
+            self.state = np.zeros(2)
+        if self.cutoff is None:
+            self.cutoff = cutoff
+        else:
+            amount = 1 - np.exp(-len(block) / (self.smoothing * self.sample_rate))
+            self.cutoff *= (cutoff / self.cutoff) ** amount
+        b, a, to_df, from_df = filter_coefficients(mode, quantize_cutoff(self.cutoff),
+                                                   round(resonance_to_q(resonance), 3), self.sample_rate)
+        if to_df is None:
+            out, self.state = signal.lfilter(b, a, block, zi=self.state)
+        else:
+            out, state = signal.lfilter(b, a, block, zi=to_df @ self.state)
+            self.state = from_df @ state
+        return out
+
+
+class Chorus:
+    # Chorus na linii opozniajacej w buforze kolowym: kilka odczytow z ulamkowym opoznieniem
+    # modulowanym LFO (fazy rozlozone rowno), glosy chorusu rozlozone w panoramie.
+    # Bloki dluzsze niz block_size sa dzielone, wiec koszt wywolania jest O(blok)
+    BASE_DELAY = 0.012
+    SWEEP = 0.008
+    MAX_RATE = 20.0
+
+    def __init__(self, sample_rate, voices=3, channels=2, block_size=1024):
+        self.sample_rate = sample_rate
+        self.voices = voices
+        self.channels = channels
+        self.block_size = block_size
+        reach = int(np.ceil((self.BASE_DELAY + self.SWEEP) * sample_rate)) + 2
+        self.size = 1 << int(np.ceil(np.log2(reach + block_size)))
+        self.mask = self.size - 1
+        self.offsets = 2 * np.pi * np.arange(voices) / voices
+        if channels == 2:
+            angle = np.pi / 4 * (1 + (np.linspace(-1, 1, voices) if voices > 1 else np.zeros(1)))
+            self.pan = np.vstack([np.cos(angle), np.sin(angle)]) * np.sqrt(2) / voices
+        else:
+            self.pan = np.full((1, voices), 1.0 / voices)
+        self.n = np.arange(block_size, dtype=np.float64)
+        self.scratch = {}
+        self.line = None
+        self.reset()
+
+    def reset(self, rows=None):
+        shape = (self.size,) if rows is None else (rows, self.size)
+        if self.line is None or self.line.shape != shape:
+            self.line = np.zeros(shape, np.float32)
+        else:
+            self.line.fill(0)
+        self.write = 0
+        self.phase = 0.0
+
+    def _buffers(self, shape):
+        # Bufory robocze na pelny block_size per liczba wierszy; krotsze bloki (np. ciecia do zdarzen
+        # MIDI w bounce) dostaja ciagle widoki na poczatek tej samej pamieci
+        rows = shape[:-1]
+        buffers = self.scratch.get(rows)
+        if buffers is None:
+            m = self.block_size
+            size = m * int(np.prod(rows))
+            buffers = (np.empty(m), np.empty(m), np.empty(m, dtype=np.intp), np.empty(m, dtype=np.intp),
+                       np.empty(size, np.float32), np.empty(size, np.float32))
+            self.scratch[rows] = buffers
+        pos, frac, idx, idx1, tap, tap1 = buffers
+        m = shape[-1]
+        size = m * int(np.prod(rows))
+        return pos[:m], frac[:m], idx[:m], idx1[:m], tap[:size].reshape(shape), tap1[:size].reshape(shape)
+
+    def process(self, block, depth, rate, mix, out=None):
+        # block: (frames,) lub (wiersze, frames); wynik: (channels,) + block.shape
+        if self.line.shape[:-1] != block.shape[:-1]:
+            self.reset(block.shape[0] if block.ndim > 1 else None)
+        if out is None:
+            out = np.empty((self.channels,) + block.shape, np.float32)
+        rate = min(max(rate, 0.0), self.MAX_RATE)
+        for start in range(0, block.shape[-1], self.block_size):
+            stop = min(start + self.block_size, block.shape[-1])
+            self._process_block(block[..., start:stop], out[..., start:stop], depth, rate, mix)
+        return out
+
+    def _process_block(self, x, out, depth, rate, mix):
+        m = x.shape[-1]
+        pos, frac, idx, idx1, tap, tap1 = self._buffers(x.shape)
+        n = self.n[:m]
+        write = self.write
+        first = min(m, self.size - write)
+        self.line[..., write:write + first] = x[..., :first]
+        self.line[..., :m - first] = x[..., first:]
+
+        out[...] = x * (1 - mix)
+        step = 2 * np.pi * rate / self.sample_rate
+        for voice in range(self.voices):
+            # opoznienie w probkach -> pozycja odczytu w buforze kolowym
+            np.multiply(n, step, out=pos)
+            pos += self.phase + self.offsets[voice]
+            np.sin(pos, out=pos)
+            pos *= -self.SWEEP * depth * self.sample_rate
+            pos += write - self.BASE_DELAY * self.sample_rate
+            pos += n
+            np.floor(pos, out=frac)
+            np.copyto(idx, frac, casting='unsafe')
+            np.subtract(pos, frac, out=frac)
+            idx &= self.mask
+            np.add(idx, 1, out=idx1)
+            idx1 &= self.mask
+            np.take(self.line, idx, axis=-1, out=tap)
+            np.take(self.line, idx1, axis=-1, out=tap1)
+            tap1 -= tap
+            tap1 *= frac
+            tap += tap1
+            for channel in range(self.channels):
+                np.multiply(tap, self.pan[channel, voice] * mix, out=tap1)
+                out[channel] += tap1
+
+        self.phase = (self.phase + step * m) % (2 * np.pi)
+        self.write = (write + m) & self.mask
+
+
+class Workspace:
+    # Bufory robocze wielokrotnego uzytku, osobne dla kazdego watku (GUI, podglad, callback audio).
+    # Bufor jest trzymany per nazwa i ksztalt bez pierwszego wymiaru, a pierwszy wymiar tylko rosnie,
+    # wiec krotsze bloki i mniejsze paczki nut dostaja widok na istniejaca pamiec
+    def __init__(self):
+        self.local = threading.local()
+
+    def get(self, name, shape, dtype=np.float32):
+        buffers = getattr(self.local, 'buffers', None)
+        if buffers is None:
+            buffers = self.local.buffers = {}
+        key = (name, shape[1:], np.dtype(dtype))
+        buffer = buffers.get(key)
+        if buffer is None or len(buffer) < shape[0]:
+            buffer = buffers[key] = np.empty(shape, dtype)
+        return buffer[:shape[0]]
+
+
+def mono_to_int16(wave, out=None):
+    if out is None:
+        out = np.empty(wave.shape, dtype=np.int16)
+    return np.multiply(wave, 32767, out=out, casting='unsafe')
+
+
+def mono_to_int16_stereo(wave, out=None):
+    # Jedyna droga mono -> przeplatane stereo int16 (L, R): float jest skalowany i rzutowany
+    # jednym ufunc prosto do lewego kanalu, int16 kopiowane bez zmian; prawy to kopia lewego
+    if out is None:
+        out = np.empty((wave.shape[-1], 2), dtype=np.int16)
+    if wave.dtype == np.int16:
+        out[:, 0] = wave
+    else:
+        mono_to_int16(wave, out[:, 0])
+    out[:, 1] = out[:, 0]
+    return out
+
+
+class SynthEngine:
+    # Renderer bez GUI: wszystkie metody przyjmuja params, frequency moze byc wektorem nut.
+    # Sygnal liczony w float32 w buforach roboczych (Workspace) operacjami in-place
+    batch_size = 8
+    tile_size = 8192
+    dtype = np.float32
+
+    def __init__(self, sample_rate=44100, duration=2.0):
+        self.sample_rate = sample_rate
+        self.duration = duration
+        self.t = np.linspace(0, self.duration, int(self.sample_rate * self.duration))
+        # faza liczona z t w float64 (dokladnosc przy wysokich nutach), modulatory z t32
+        self.t32 = self.t.astype(self.dtype)
+        self.index = np.arange(len(self.t), dtype=np.float64)
+        self.work = Workspace()
+        self.rng = np.random.default_rng()
+
+        # Ksztalty fal dostaja faze w cyklach (akumulator fazy), czestotliwosc do wyboru mipmapy
+        # i bufor wyjsciowy
+        self.wavetables = WavetableBank(sample_rate, self.work)
+        self.wave_shapes = {
+            'sine': lambda phase, freq, out: self.wavetables.lookup('sine', phase, freq, out),
+            'square': lambda phase, freq, out: self.wavetables.lookup('square', phase, freq, out),
+            'sawtooth': lambda phase, freq, out: self.wavetables.lookup('sawtooth', phase, freq, out),
+            'triangle': lambda phase, freq, out: self.wavetables.lookup('triangle', phase, freq, out),
+            'noise': self.noise_wave,
+            'custom': self.custom_wave  # Nowa, uproszczona wersja
+        }
+
+    def noise(self, length, scale=1.0):
+        # Szum wspolny dla wszystkich wierszy paczki, generowany od razu w float32
+        noise = self.work.get('noise', (length,))
+        self.rng.standard_normal(dtype=self.dtype, out=noise)
+        if scale != 1.0:
+            noise *= scale
+        return noise
+
+    def noise_wave(self, phase, freq, out):
+        out[...] = self.noise(phase.shape[-1])
+        return out
+
+    def custom_wave(self, phase, freq, out):
+        # Uproszczona wersja bez custom_paramX: mieszanka sinusoidy i szumu
+        self.wavetables.lookup('custom', phase, freq, out)
+        out += self.noise(phase.shape[-1], 0.3)
+        return out
+
+    def generate_wave(self, params, freq=None, length=None):
+        if freq is None:
+            freq = params.get('frequency', 440.0)
+        return self.generate_batch(params, [freq], length)[0]
+
+    def synthesize(self, params, phase, t, freq, out=None):
+        # Oscylatory, modulacje i efekty nieliniowe; phase w cyklach (float32, zawinieta do [0, 1)),
+        # t to czas od poczatku nuty. Wspolne dla renderu offline (cala nuta) i strumieniowego
+        # (blok po bloku); wynik trafia do out
+        work = self.work
+        if out is None:
+            out = np.empty(phase.shape, self.dtype)
+        osc = work.get('osc', phase.shape)
+        mix = params.get('wave_mix', 0.5)
+        self.wave_shapes[params.get('wave_shape1', 'sine')](phase, freq, out)
+        out *= 1 - mix
+        self.wave_shapes[params.get('wave_shape2', 'sine')](phase, freq, osc)
+        osc *= mix
+        out += osc
+
+        # Harmoniczne z rekurencji sin(kx) = 2cos(x)sin((k-1)x) - sin((k-2)x) zamiast 5x np.sin;
+        # harmoniczne powyzej Nyquista sa pomijane
+        x = work.get('x', phase.shape)
+        np.multiply(phase, 2 * np.pi, out=x)
+        cos2 = work.get('cos2', phase.shape)
+        np.cos(x, out=cos2)
+        cos2 *= 2
+        harm = work.get('harm', phase.shape)
+        np.sin(x, out=harm)
+        harm_prev = work.get('harm_prev', phase.shape)
+        harm_prev.fill(0)
+        for i in range(1, 6):
+            weight = params.get(f'harm{i}_weight', 1.0 / (2 ** (i - 1)))
+            weight = weight * (np.asarray(freq) * i < self.sample_rate / 2)
+            np.multiply(harm, weight, out=osc)
+            out += osc
+            np.multiply(cos2, harm, out=osc)
+            np.subtract(osc, harm_prev, out=harm_prev)
+            harm_prev, harm = harm, harm_prev
+
+        # Modulatory zaleza tylko od t, wiec liczymy je raz (n,) i rozglaszamy na wiersze
+        mod = work.get('mod', t.shape)
+
+        def lfo(rate, depth, offset=0.0):
+            np.multiply(t, 2 * np.pi * rate, out=mod)
+            np.sin(mod, out=mod)
+            np.multiply(mod, depth, out=mod)
+            if offset:
+                np.add(mod, offset, out=mod)
+            return mod
+
+        if params.get('freq_mod', 0.0) > 0:
+            lfo(params.get('freq_mod_rate', 0.0), params['freq_mod'])
+            mod *= t
+            np.add(phase, mod, out=out)
+            out *= 2 * np.pi
+            np.sin(out, out=out)
+        if params.get('amp_mod', 0.0) > 0:
+            out *= lfo(params.get('amp_mod_rate', 0.0), params['amp_mod'], 1.0)
+
+        if params.get('vibrato_depth', 0.0) > 0:
+            lfo(params.get('vibrato_rate', 0.0), params['vibrato_depth'])
+            np.multiply(phase, 2 * np.pi, out=out)
+            out += mod
+            np.sin(out, out=out)
+        if params.get('tremolo_depth', 0.0) > 0:
+            out *= lfo(params.get('tremolo_rate', 0.0), params['tremolo_depth'], 1.0)
+        if params.get('noise_level', 0.0) > 0:
+            out += self.noise(len(t), params['noise_level'])
+        if params.get('distortion', 0.0) > 0:
+            out *= 1 + params['distortion'] * 10
+            np.tanh(out, out=out)
+        if params.get('bit_crush', 0.0) > 0:
+            levels = 2 ** (16 - int(params['bit_crush'] * 14))
+            out *= levels
+            np.round(out, out=out)
+            out /= levels
+        if params.get('fold_amount', 0.0) > 0:
+            out *= np.pi * params['fold_amount']
+            np.sin(out, out=out)
+        return out
+
+    def peak_estimate(self, params):
+        # Gorne oszacowanie amplitudy synthesize(); render strumieniowy nie moze normalizowac
+        # do szczytu calej nuty, wiec skaluje przez te wartosc
+        if params.get('freq_mod', 0.0) > 0 or params.get('vibrato_depth', 0.0) > 0:
+            peak = 1.0
+        else:
+            peak = 1.0 + sum(abs(params.get(f'harm{i}_weight', 1.0 / (2 ** (i - 1)))) for i in range(1, 6))
+        peak *= 1 + params.get('amp_mod', 0.0)
+        peak *= 1 + params.get('tremolo_depth', 0.0)
+        peak += 3 * params.get('noise_level', 0.0)
+        if params.get('distortion', 0.0) > 0 or params.get('fold_amount', 0.0) > 0:
+            peak = min(peak, 1.0)
+        cutoff = params.get('filter_cutoff', 20000)
+        if cutoff < 20000:
+            # Filtr idzie po syntezie: rezonans podbija pasmo przy cutoff ponad szczyt wejscia
+            peak *= filter_peak_gain(params.get('filter_mode', 'lowpass'), quantize_cutoff(float(cutoff)),
+                                     round(resonance_to_q(params.get('filter_resonance', 0.0)), 3), self.sample_rate)
+        return max(peak, 1e-6)
+
+    def generate_batch(self, params, freqs, length=None, out=None, envelope=None):
+        # Jeden przebieg NumPy dla calego wektora czestotliwosci -> tablica (nuty x probki);
+        # length ogranicza render do poczatkowego okna (podglad). Bez out wynik dostaje wlasna
+        # tablice, bo bywa przekazywany do innego watku. envelope: gotowa obwiednia ADSR
+        # (wspolna dla wszystkich paczek w render_notes)
+        t = self.t[:length]
+        freq = np.asarray(freqs, dtype=np.float64).reshape(-1, 1)
+        rows = len(freq)
+        if out is None:
+            out = np.empty((rows, len(t)), self.dtype)
+        wave = out
+        # Oscylatory kafelkami po tile_size probek: bufory robocze (nuty x kafelek), w tym faza
+        # float64, mieszcza sie w cache zamiast kilku tablic (nuty x cala nuta)
+        for start in range(0, len(t), self.tile_size):
+            stop = min(start + self.tile_size, len(t))
+            shape = (rows, stop - start)
+            phase64 = self.work.get('phase64', shape, np.float64)
+            np.multiply(freq, t[start:stop], out=phase64)
+            # Zawiniecie do [0, 1) przez floor i odejmowanie: np.remainder na float64 kosztowal wiecej
+            # niz cala reszta syntezy; czesc calkowita jest dokladna w float32 (ponizej 2**24 cykli)
+            phase = self.work.get('phase', shape)
+            np.floor(phase64, out=phase, casting='same_kind')
+            np.subtract(phase64, phase, out=phase, casting='same_kind')
+            wave[:, start:stop] = self.synthesize(params, phase, self.t32[start:stop], freq,
+                                                  self.work.get('tile', shape))
+
+        if params.get('filter_cutoff', 20000) < 20000:
+            b, a, _, _ = filter_coefficients(params.get('filter_mode', 'lowpass'), float(params['filter_cutoff']),
+                                             round(resonance_to_q(params.get('filter_resonance', 0.0)), 3),
+                                             self.sample_rate)
+            wave[...] = signal.lfilter(b, a, wave, axis=-1)
+        if params.get('chorus_depth', 0.0) > 0:
+            chorus = Chorus(self.sample_rate, channels=1)
+            chorus.process(wave, params['chorus_depth'], params.get('chorus_rate', 0.0),
+                           params.get('chorus_mix', 0.5), out=wave[np.newaxis])
+
+        if len(t) < len(self.t):
+            # Okno podgladu skalujemy jak cala nute, a nie do wlasnego szczytu: fala przed obwiednia
+            # powtarza sie okresowo, wiec jej szczyt w oknie razy szczyt obwiedni przybliza szczyt
+            # calej nuty; obwiednia liczona tylko dla okna
+            peak = np.maximum(wave.max(axis=-1), -wave.min(axis=-1)) * self.adsr_peak(params)
+            wave *= self.apply_adsr(params, out=self.work.get('adsr', (len(t),)), window=len(t))
+        else:
+            if envelope is None:
+                envelope = self.apply_adsr(params, out=self.work.get('adsr', (len(self.t),)))
+            wave *= envelope
+            peak = np.maximum(wave.max(axis=-1), -wave.min(axis=-1))
+        wave /= peak[:, np.newaxis]
+        return wave
+
+    def adsr_peak(self, params):
+        # Szczyt obwiedni z apply_adsr bez jej liczenia: atak dochodzi do 1.0, potem jest sustain
+        if params.get('attack_time', 0.1) > 0 or params.get('decay_time', 0.2) > 0:
+            return max(1.0, params.get('sustain_level', 0.7))
+        return max(params.get('sustain_level', 0.7), 1e-6)
+
+    def apply_adsr(self, params, length=None, out=None, window=None):
+        # window: tylko pierwsze window probek obwiedni nuty o dlugosci length (podglad)
+        if length is None:
+            length = len(self.t)
+        if window is None:
+            window = length
+        if out is None:
+            out = np.empty(window, self.dtype)
+        attack_samples = int(params.get('attack_time', 0.1) * self.sample_rate)
+        decay_samples = int(params.get('decay_time', 0.2) * self.sample_rate)
+        release_samples = int(params.get('release_time', 0.3) * self.sample_rate)
+        total_envelope_samples = attack_samples + decay_samples + release_samples
+
+        if total_envelope_samples > length:
+            scale_factor = length / total_envelope_samples
+            attack_samples = int(attack_samples * scale_factor)
+            decay_samples = int(decay_samples * scale_factor)
+            release_samples = int(release_samples * scale_factor)
+            total_envelope_samples = attack_samples + decay_samples + release_samples
+
+        sustain_samples = max(0, length - total_envelope_samples)
+        sustain_level = params.get('sustain_level', 0.7)
+
+        # Odcinki jak np.linspace(start, stop, n), ale wpisywane wprost do out
+        pos = 0
+        for count, start, stop in ((attack_samples, 0.0, 1.0), (decay_samples, 1.0, sustain_level),
+                                   (sustain_samples, sustain_level, sustain_level),
+                                   (release_samples, sustain_level, 0.0)):
+            segment = out[pos:min(pos + count, window)]
+            if count > 1 and start != stop:
+                np.multiply(Envelope.steps(count - 1, start=0)[:len(segment)], (stop - start) / (count - 1),
+                            out=segment)
+                segment += start
+            else:
+                segment.fill(start)
+            pos += count
+        out[pos:] = 0
+        return out
+
+    def render_notes(self, params, notes):
+        # Generator (nuty, fale) w paczkach po batch_size, zeby ograniczyc zuzycie pamieci;
+        # fale kolejnych paczek trafiaja do tego samego bufora, wiec sa wazne do nastepnego kroku
+        notes = list(notes)
+        out = np.empty((min(self.batch_size, len(notes)), len(self.t)), self.dtype)
+        envelope = self.apply_adsr(params)
+        for start in range(0, len(notes), self.batch_size):
+            chunk = notes[start:start + self.batch_size]
+            yield chunk, self.generate_batch(params, note_to_freq(chunk), out=out[:len(chunk)], envelope=envelope)
+
+
+class Resampler:
+    # Polifazowy resampler (okienkowany sinc) dla stosunkow 12-TET; jadra filtrow sa
+    # liczone raz na (jakosc, przesuniecie w poltonach) we wspolnym cache klasy
+    # jakosc: (maks. mianownik ulamka, polowa dlugosci filtra na faze, beta okna Kaisera)
+    qualities = {
+        'draft': (96, 4, 5.0),
+        'high': (1024, 16, 8.6),
+    }
+    _kernels = {}
+
+    def __init__(self, quality='high'):
+        self.quality = quality
+
+    def precompute(self, offsets):
+        # Jadra dla wszystkich przesuniec naraz, np. przed startem puli procesow
+        return {(self.quality, semitones): self.kernel(semitones) for semitones in set(offsets) if semitones}
+
+    @classmethod
+    def install(cls, kernels):
+        cls._kernels.update(kernels)
+
+    def ratio(self, semitones):
+        max_den = self.qualities[self.quality][0]
+        frac = Fraction(2 ** (-semitones / 12)).limit_denominator(max_den)
+        return frac.numerator, frac.denominator
+
+    def kernel(self, semitones):
+        key = (self.quality, semitones)
+        if key not in self._kernels:
+            up, down = self.ratio(semitones)
+            _, taps, beta = self.qualities[self.quality]
+            max_rate = max(up, down)
+            half_len = taps * max_rate
+            h = signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', beta))
+            self._kernels[key] = (up, down, h.astype(np.float32))
+        return self._kernels[key]
+
+    def output_length(self, length, semitones):
+        up, down = self.ratio(semitones)
+        return -(-length * up // down)
+
+    def resample(self, data, semitones):
+        if semitones == 0:
+            return np.array(data, dtype=np.float32)
+        up, down, h = self.kernel(semitones)
+        return signal.resample_poly(data, up, down, window=h)
+
+
+@lru_cache(maxsize=256)
+def sinc_kernel(cutoff, half_taps=16, beta=8.6, phases=256):
+    # Tablica okienkowanego sinc (Kaiser) dla odczytu w ulamkowej pozycji: wiersz = faza
+    # (frac * phases), kolumny = probki od index - width + 1 do index + width;
+    # cutoff < 1 zaweza pasmo przy transpozycji w gore, zeby nie bylo aliasingu
+    width = int(np.ceil(half_taps / cutoff))
+    x = np.arange(-width + 1, width + 1)[None, :] - np.arange(phases + 1)[:, None] / phases
+    window = np.i0(beta * np.sqrt(np.clip(1 - (x / width) ** 2, 0, None))) / np.i0(beta)
+    return (cutoff * np.sinc(cutoff * x) * window).astype(np.float32), width
+
+
+class Envelope:
+    # ADSR jako maszyna stanow: note_on/note_off zamiast obwiedni wypalonej w buforze
+    IDLE, ATTACK, DECAY, SUSTAIN, RELEASE = range(5)
+    _steps = np.arange(1, dtype=np.float32)
+
+    @classmethod
+    def steps(cls, stop, start=1):
+        # Widok na wspolne [start, start + 1, ..., stop] w float32, zamiast np.arange przy kazdej rampie
+        if len(cls._steps) <= stop:
+            cls._steps = np.arange(max(stop + 1, 2 * len(cls._steps)), dtype=np.float32)
+        return cls._steps[start:stop + 1]
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.state = self.ATTACK
+        self.level = 0.0
+        self.release_rate = None
+
+    def note_off(self):
+        if self.state != self.IDLE:
+            self.state = self.RELEASE
+            self.release_rate = None
+
+    def fade(self, seconds):
+        # Szybkie wygaszenie skradzionego glosu, bez trzasku
+        if self.state != self.IDLE:
+            self.state = self.RELEASE
+            self.release_rate = max(self.level, 1e-6) / max(1.0, seconds * self.sample_rate)
+
+    def _ramp(self, out, pos, target, rate):
+        distance = target - self.level
+        if rate <= 0 or abs(distance) < 1e-9:
+            self.level = target
+            return pos, True
+        count = int(np.ceil(abs(distance) / rate))
+        done = count <= len(out) - pos
+        count = min(count, len(out) - pos)
+        segment = out[pos:pos + count]
+        np.multiply(self.steps(count), np.sign(distance) * rate, out=segment)
+        segment += self.level
+        if done:
+            out[pos + count - 1] = target
+        self.level = float(out[pos + count - 1])
+        return pos + count, done
+
+    def render(self, frames, params, out=None):
+        if out is None:
+            out = np.empty(frames, dtype=np.float32)
+        sustain = params.get('sustain_level', 0.7)
+        pos = 0
+        while pos < frames:
+            if self.state == self.ATTACK:
+                pos, done = self._ramp(out, pos, 1.0, 1.0 / max(1.0, params.get('attack_time', 0.1) * self.sample_rate))
+                if done:
+                    self.state = self.DECAY
+            elif self.state == self.DECAY:
+                pos, done = self._ramp(out, pos, sustain,
+                                       abs(1.0 - sustain) / max(1.0, params.get('decay_time', 0.2) * self.sample_rate))
+                if done:
+                    self.state = self.SUSTAIN
+            elif self.state == self.SUSTAIN:
+                self.level = sustain
+                out[pos:] = sustain
+                break
+            elif self.state == self.RELEASE:
+                if self.release_rate is None:
+                    self.release_rate = max(self.level, 1e-6) / max(1.0, params.get('release_time', 0.3) * self.sample_rate)
+                pos, done = self._ramp(out, pos, 0.0, self.release_rate)
+                if done:
+                    self.state = self.IDLE
+            else:
+                out[pos:] = 0
+                break
+        return out
+
+
+class SynthVoice:
+    def __init__(self, note, velocity, sample_rate):
+        self.note = note
+        self.velocity = velocity
+        self.freq = float(note_to_freq(note))
+        self.sample_rate = sample_rate
+        self.envelope = Envelope(sample_rate)
+        self.phase = 0.0
+        self.position = 0
+        self.filter = VoiceFilter(sample_rate)
+        self.started = 0
+        self.killed = False
+        self.trace = None
+
+    @property
+    def finished(self):
+        return self.envelope.state == Envelope.IDLE
+
+    @property
+    def releasing(self):
+        return self.envelope.state == Envelope.RELEASE
+
+    @property
+    def level(self):
+        return self.envelope.level * self.velocity / 127
+
+    def release(self):
+        self.envelope.note_off()
+
+    def kill(self):
+        self.killed = True
+        self.envelope.fade(0.005)
+
+    def render(self, synth, params, frames):
+        # Wynik lezy w buforze roboczym silnika i jest wazny do renderu nastepnego glosu
+        work = synth.work
+        n = synth.index[:frames] if frames <= len(synth.index) else np.arange(frames, dtype=np.float64)
+        clock = work.get('voice_clock', (frames,), np.float64)
+        np.multiply(n, self.freq / self.sample_rate, out=clock)
+        clock += self.phase
+        np.remainder(clock, 1.0, out=clock)
+        phase = work.get('voice_phase', (frames,))
+        phase[...] = clock
+        np.add(n, self.position, out=clock)
+        clock /= self.sample_rate
+        t = work.get('voice_t', (frames,))
+        t[...] = clock
+        self.phase = (self.phase + self.freq * frames / self.sample_rate) % 1.0
+        self.position += frames
+
+        wave = synth.synthesize(params, phase, t, self.freq, work.get('voice_wave', (frames,)))
+        cutoff = params.get('filter_cutoff', 20000)
+        if cutoff < 20000:
+            wave[...] = self.filter.process(wave, params.get('filter_mode', 'lowpass'), float(cutoff),
+                                            params.get('filter_resonance', 0.0))
+        elif self.filter.mode is not None:
+            self.filter.reset()
+        wave *= self.envelope.render(frames, params, work.get('voice_envelope', (frames,)))
+        wave *= self.velocity / 127 / synth.peak_estimate(params)
+        return wave
+
+
+class ChannelVoice:
+    # Glos z gotowego pygame.mixer.Sound: glosnosc ustawiana na kanale, nie na wspolnym Sound
+    def __init__(self, note, channel, sound, volume):
+        self.note = note
+        self.channel = channel
+        self.level = volume
+        self.started = 0
+        self.killed = False
+        self.releasing = False
+        channel.set_volume(volume)
+        channel.play(sound)
+
+    @property
+    def finished(self):
+        return self.killed or not self.channel.get_busy()
+
+    def release(self, fade_ms=0):
+        self.releasing = True
+        if fade_ms > 0:
+            self.channel.fadeout(fade_ms)
+        else:
+            self.channel.stop()
+
+    def kill(self):
+        self.killed = True
+        self.channel.stop()
+
+
+class WavReader:
+    # Parser RIFF/WAVE bez scipy: naglowek czytany recznie, dane mapowane przez np.memmap,
+    # a konwersja do mono float32 (downmix, skala) idzie kawalkami po chunk_frames ramek
+    chunk_frames = 65536
+
+    def __init__(self, path):
+        self.path = path
+        data = None
+        fmt = None
+        with open(path, 'rb') as f:
+            riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+            if riff != b'RIFF' or wave != b'WAVE':
+                raise ValueError("not a RIFF/WAVE file")
+            file_size = os.fstat(f.fileno()).st_size
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    break
+                chunk_id, size = struct.unpack('<4sI', header)
+                if chunk_id == b'fmt ':
+                    body = f.read(size + (size & 1))
+                    fmt = struct.unpack('<HHIIHH', body[:16])
+                    if fmt[0] == 0xFFFE and size >= 26:
+                        fmt = (struct.unpack('<H', body[24:26])[0],) + fmt[1:]
+                    continue
+                if chunk_id == b'data':
+                    # rozmiar bywa zawyzony w plikach nagrywanych strumieniowo
+                    data = (f.tell(), min(size, file_size - f.tell()))
+                f.seek(size + (size & 1), 1)
+        if fmt is None or data is None:
+            raise ValueError("missing fmt or data chunk")
+        tag, self.channels, self.rate, _, self.block_align, self.bits = fmt
+        kinds = {(1, 8): np.uint8, (1, 16): np.dtype('<i2'), (1, 24): None, (1, 32): np.dtype('<i4'),
+                 (3, 32): np.dtype('<f4'), (3, 64): np.dtype('<f8')}
+        if (tag, self.bits) not in kinds:
+            raise ValueError(f"unsupported WAV format {tag}, {self.bits}-bit")
+        self.frames = data[1] // self.block_align
+        self.scale = 1.0 if tag == 3 else 1.0 / 2 ** (self.bits - 1)
+        raw = np.memmap(path, dtype=np.uint8, mode='r', offset=data[0],
+                        shape=(self.frames * self.block_align,)) if self.frames else np.zeros(0, np.uint8)
+        if self.bits == 24:
+            self.samples = raw.reshape(self.frames, self.channels, 3)
+        else:
+            self.samples = raw.view(kinds[(tag, self.bits)]).reshape(self.frames, self.channels)
+        self._peak = None
+
+    @property
+    def duration(self):
+        return self.frames / self.rate
+
+    def read_mono(self, start, count, out=None, gain=1.0):
+        # Ramki [start, start + count) jako mono float32; zwraca widok out na odczytana czesc
+        block = self.samples[start:start + count]
+        if out is None:
+            out = np.empty(len(block), np.float32)
+        out = out[:len(block)]
+        if self.bits == 24:
+            # trzy bajty little-endian; najstarszy jako int8 niesie znak
+            ints = block[..., 2].astype(np.int8).astype(np.int32) << 16
+            ints |= block[..., 1].astype(np.int32) << 8
+            ints |= block[..., 0]
+            block = ints
+        np.add.reduce(block, axis=1, dtype=np.float32, out=out)
+        if self.bits == 8:
+            out -= 128 * self.channels
+        out *= self.scale * gain / self.channels
+        return out
+
+    def chunks(self, gain=1.0):
+        buffer = np.empty(self.chunk_frames, np.float32)
+        for start in range(0, self.frames, self.chunk_frames):
+            yield start, self.read_mono(start, self.chunk_frames, buffer, gain)
+
+    def peak(self):
+        # Szczyt sygnalu mono w jednym przebiegu strumieniowym, bez trzymania calego pliku
+        if self._peak is None:
+            peak = 0.0
+            for _, chunk in self.chunks():
+                if len(chunk):
+                    peak = max(peak, float(chunk.max()), -float(chunk.min()))
+            self._peak = peak
+        return self._peak
+
+    def read_normalized(self):
+        # Cala probka w pamieci: jedna tablica wynikowa, szczyt liczony w trakcie konwersji
+        out = np.empty(self.frames, np.float32)
+        peak = 0.0
+        for start, chunk in self.chunks():
+            out[start:start + len(chunk)] = chunk
+            if len(chunk):
+                peak = max(peak, float(chunk.max()), -float(chunk.min()))
+        self._peak = peak
+        if peak > 0:
+            out *= 1.0 / peak
+        return out
+
+
+class WavWriter:
+    # Zapis WAV (16-bit PCM albo 32-bit float) kawalkami: naglowek z zerowymi rozmiarami,
+    # poprawiany w close()
+    def __init__(self, path, sample_rate, channels=2, sample_format='int16'):
+        self.file = open(path, 'wb')
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dtype = np.dtype(SAMPLE_FORMATS[sample_format])
+        self.frames = 0
+        self.pcm = np.empty((0, channels), self.dtype)
+        self._header(0)
+
+    def _header(self, data_size):
+        width = self.dtype.itemsize
+        tag = 3 if self.dtype.kind == 'f' else 1
+        self.file.write(b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE')
+        self.file.write(b'fmt ' + struct.pack('<IHHIIHH', 16, tag, self.channels, self.sample_rate,
+                                              self.sample_rate * self.channels * width, self.channels * width,
+                                              8 * width))
+        self.file.write(b'data' + struct.pack('<I', data_size))
+
+    def write(self, block):
+        # block: (ramki, kanaly) float32 w [-1, 1]
+        if self.dtype == np.float32:
+            self.write_pcm(block)
+            return
+        if len(self.pcm) < len(block):
+            self.pcm = np.empty((len(block), self.channels), self.dtype)
+        pcm = self.pcm[:len(block)]
+        np.multiply(block, 32767, out=pcm, casting='unsafe')
+        self.write_pcm(pcm)
+
+    def write_pcm(self, pcm):
+        # pcm juz w formacie pliku
+        self.file.write(np.ascontiguousarray(pcm, dtype=self.dtype).tobytes())
+        self.frames += len(pcm)
+
+    def close(self):
+        self.file.seek(0)
+        self._header(self.frames * self.channels * self.dtype.itemsize)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SampleStream:
+    # Probka odtwarzana z dysku: poczatek (head) zostaje w pamieci, reszta jest czytana z memmap
+    # z wyprzedzeniem przez watek w tle, osobno dla kazdego otwartego kursora (glosu)
+    def __init__(self, reader, head_seconds=1.0, block_frames=16384, blocks_ahead=8):
+        self.reader = reader
+        self.rate = reader.rate
+        self.frames = reader.frames
+        peak = reader.peak()
+        self.gain = 1.0 / peak if peak > 0 else 1.0
+        self.head = reader.read_mono(0, int(head_seconds * reader.rate), gain=self.gain)
+        self.block_frames = block_frames
+        self.blocks_ahead = blocks_ahead
+        self.underruns = 0
+        self.cursors = set()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def open(self, prefetch=True):
+        # prefetch=False: kursor czyta z pliku synchronicznie (render offline szybszy niz czas rzeczywisty)
+        cursor = StreamCursor(self)
+        if not prefetch:
+            cursor.sync = True
+            return cursor
+        with self._condition:
+            self.cursors.add(cursor)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return cursor
+
+    def close(self, cursor):
+        with self._condition:
+            self.cursors.discard(cursor)
+
+    def wake(self):
+        with self._condition:
+            self._condition.notify()
+
+    def _run(self):
+        # Watek konczy sie razem z ostatnim kursorem; open() uruchamia go ponownie
+        while True:
+            with self._condition:
+                if not self.cursors:
+                    self._thread = None
+                    return
+                pending = [cursor for cursor in self.cursors
+                           if len(cursor.blocks) < self.blocks_ahead and cursor.fetch < self.frames]
+                if not pending:
+                    self._condition.wait(0.05)
+                    continue
+            for cursor in pending:
+                block = self.reader.read_mono(cursor.fetch, self.block_frames, gain=self.gain)
+                cursor.fetch += len(block)
+                cursor.blocks.append(block)
+
+
+class StreamCursor:
+    # Pozycja odczytu jednego glosu; read() wolane z callbacku audio, bez czekania na dysk
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+        self.fetch = len(stream.head)
+        self.blocks = deque()
+        self.offset = 0
+        self.sync = False
+
+    @property
+    def exhausted(self):
+        return self.position >= self.stream.frames
+
+    def read(self, out):
+        # Wypelnia out kolejnymi ramkami; zwraca liczbe prawdziwych ramek. Brak danych z watku
+        # w tle (underrun) daje cisze bez przesuwania pozycji
+        head = self.stream.head
+        filled = 0
+        if self.position < len(head):
+            filled = min(len(out), len(head) - self.position)
+            out[:filled] = head[self.position:self.position + filled]
+            self.position += filled
+        while filled < len(out) and self.blocks:
+            block = self.blocks[0]
+            count = min(len(out) - filled, len(block) - self.offset)
+            out[filled:filled + count] = block[self.offset:self.offset + count]
+            filled += count
+            self.offset += count
+            self.position += count
+            if self.offset == len(block):
+                self.blocks.popleft()
+                self.offset = 0
+                self.stream.wake()
+        if filled < len(out) and self.sync:
+            count = len(self.stream.reader.read_mono(self.position, len(out) - filled, out[filled:], self.stream.gain))
+            filled += count
+            self.position += count
+        if filled < len(out):
+            if not self.exhausted:
+                self.stream.underruns += 1
+            out[filled:] = 0
+        return filled
+
+    def close(self):
+        self.stream.close(self)
+
+
+class MemorySample:
+    # Probka w pamieci z tym samym interfejsem co SampleStream: open() daje kursor dla glosu,
+    # wszystkie glosy czytaja jeden wspolny bufor
+    def __init__(self, data, rate):
+        self.data = data
+        self.rate = rate
+        self.frames = len(data)
+
+    def open(self, prefetch=True):
+        return MemoryCursor(self)
+
+
+class MemoryCursor:
+    def __init__(self, sample):
+        self.sample = sample
+        self.position = 0
+
+    @property
+    def exhausted(self):
+        return self.position >= self.sample.frames
+
+    def read(self, out):
+        chunk = self.sample.data[self.position:self.position + len(out)]
+        out[:len(chunk)] = chunk
+        out[len(chunk):] = 0
+        self.position += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        pass
+
+
+class SampleZone:
+    # Probka z nuta bazowa (root) grana w zakresie klawiszy i dynamiki [low, high] x [vel_low, vel_high]
+    def __init__(self, source, root, low=0, high=127, vel_low=0, vel_high=127, name=""):
+        self.source = source
+        self.root = root
+        self.low = low
+        self.high = high
+        self.vel_low = vel_low
+        self.vel_high = vel_high
+        self.name = name
+
+    def covers(self, note, velocity):
+        return self.low <= note <= self.high and self.vel_low <= velocity <= self.vel_high
+
+    def step(self, note, sample_rate):
+        # Krok odczytu na ramke wyjscia: transpozycja od roota razy stosunek czestotliwosci probkowania
+        return 2 ** ((note - self.root) / 12) * self.source.rate / sample_rate
+
+
+class Keymap:
+    # Strefy probek; wysokosc powstaje przy odtwarzaniu przez ulamkowy krok odczytu, wiec nuty
+    # nie kosztuja pamieci. Gdy strefy sie nakladaja, gra ta z najblizszym rootem
+    def __init__(self):
+        self.zones = []
+
+    def __len__(self):
+        return len(self.zones)
+
+    def add(self, zone):
+        self.zones.append(zone)
+
+    def clear(self):
+        self.zones = []
+
+    def underruns(self):
+        # Tylko strefy strumieniowane z dysku (SampleStream) moga nie zdazyc z odczytem
+        return sum(getattr(zone.source, 'underruns', 0) for zone in self.zones)
+
+    def find(self, note, velocity):
+        best = None
+        for zone in self.zones:
+            if zone.covers(note, velocity) and (best is None or abs(note - zone.root) < abs(note - best.root)):
+                best = zone
+        return best
+
+    def describe(self):
+        return "\n".join(f"{zone.name}: root {zone.root}, keys {zone.low}-{zone.high}, "
+                         f"velocity {zone.vel_low}-{zone.vel_high}" for zone in self.zones)
+
+
+class SampleVoice:
+    # Glos probki dla StreamingEngine: czyta z kursora i przesuwa sie o ulamkowy krok na ramke
+    # wyjscia (zmiana wysokosci * rate probki / rate wyjscia); 'draft' interpoluje liniowo
+    # (gra na zywo), 'high' czyta przez okienkowany sinc z sinc_kernel (bounce)
+    def __init__(self, note, velocity, sample_rate, cursor, step, release_time=0.3, quality='draft'):
+        self.note = note
+        self.velocity = velocity
+        self.sample_rate = sample_rate
+        self.cursor = cursor
+        self.step = step
+        self.envelope = Envelope(sample_rate)
+        self.envelope_params = {'attack_time': 0.002, 'decay_time': 0.0, 'sustain_level': 1.0,
+                                'release_time': release_time}
+        if quality == 'high':
+            self.kernel, self.width = sinc_kernel(round(min(1.0, 1.0 / step), 3))
+        else:
+            self.kernel, self.width = None, 1
+        # Przed pozycja odczytu zostaje width - 1 probek historii dla lewej polowy jadra
+        self.history = self.width - 1
+        self.source = np.zeros(4096, np.float32)
+        self.filled = self.history
+        self.end = None
+        self.position = float(self.history)
+        self.started = 0
+        self.killed = False
+        self.trace = None
+
+    @property
+    def finished(self):
+        return self.envelope.state == Envelope.IDLE
+
+    @property
+    def releasing(self):
+        return self.envelope.state == Envelope.RELEASE
+
+    @property
+    def level(self):
+        return self.envelope.level * self.velocity / 127
+
+    def release(self):
+        self.envelope.note_off()
+
+    def kill(self):
+        self.killed = True
+        self.envelope.fade(0.005)
+
+    def render(self, synth, params, frames):
+        work = synth.work
+        needed = int(self.position + frames * self.step) + self.width + 1
+        if needed > len(self.source):
+            grown = np.zeros(max(needed, 2 * len(self.source)), np.float32)
+            grown[:self.filled] = self.source[:self.filled]
+            self.source = grown
+        if self.filled < needed:
+            if self.end is None:
+                got = self.cursor.read(self.source[self.filled:needed])
+                if got < needed - self.filled and self.cursor.exhausted:
+                    self.end = self.filled + got
+            else:
+                self.source[self.filled:needed] = 0
+            self.filled = needed
+
+        n = synth.index[:frames] if frames <= len(synth.index) else np.arange(frames, dtype=np.float64)
+        position = work.get('sample_position', (frames,), np.float64)
+        np.multiply(n, self.step, out=position)
+        position += self.position
+        index = work.get('sample_index', (frames,), np.intp)
+        np.copyto(index, position, casting='unsafe')
+        frac = work.get('sample_frac', (frames,))
+        np.subtract(position, index, out=frac, casting='unsafe')
+        wave = work.get('voice_wave', (frames,))
+        if self.kernel is None:
+            high = work.get('sample_high', (frames,))
+            self.source.take(index, out=wave)
+            index += 1
+            self.source.take(index, out=high)
+            high -= wave
+            high *= frac
+            wave += high
+        else:
+            phases = len(self.kernel) - 1
+            phase = work.get('sample_phase', (frames,), np.intp)
+            frac *= phases
+            np.rint(frac, out=frac)
+            np.copyto(phase, frac, casting='unsafe')
+            taps = work.get('sample_taps', (frames, 2 * self.width), np.intp)
+            np.add(index[:, None], np.arange(1 - self.width, self.width + 1), out=taps)
+            gathered = work.get('sample_gathered', (frames, 2 * self.width))
+            self.source.take(taps, out=gathered)
+            weights = work.get('sample_weights', (frames, 2 * self.width))
+            self.kernel.take(phase, axis=0, out=weights)
+            gathered *= weights
+            gathered.sum(axis=1, out=wave)
+        wave *= self.envelope.render(frames, self.envelope_params, work.get('voice_envelope', (frames,)))
+        wave *= self.velocity / 127
+
+        # Zuzyte ramki zrodla wypadaja z poczatku bufora
+        self.position += frames * self.step
+        consumed = min(max(int(self.position) - self.history, 0), self.filled)
+        self.source[:self.filled - consumed] = self.source[consumed:self.filled]
+        self.filled -= consumed
+        self.position -= consumed
+        if self.end is not None:
+            self.end -= consumed
+            if self.position >= self.end:
+                self.envelope.state = Envelope.IDLE
+        if self.finished:
+            self.cursor.close()
+        return wave
+
+
+class VoicePool:
+    # Przydzial glosow z limitem polifonii; przy braku miejsca glos jest kradziony wg polityki
+    policies = ('release-first', 'oldest', 'quietest', 'same-note')
+
+    def __init__(self, max_voices=32, policy='release-first'):
+        self.max_voices = max_voices
+        self.policy = policy
+        self.voices = []
+        self.stolen = 0
+        self.peak = 0
+        self._serial = 0
+
+    def active(self):
+        return [voice for voice in self.voices if not voice.killed]
+
+    def choose_victim(self, active, note):
+        if self.policy == 'same-note':
+            same = [voice for voice in active if voice.note == note]
+            if same:
+                return min(same, key=lambda voice: voice.started)
+        elif self.policy == 'quietest':
+            return min(active, key=lambda voice: voice.level)
+        elif self.policy == 'release-first':
+            releasing = [voice for voice in active if voice.releasing]
+            if releasing:
+                return min(releasing, key=lambda voice: voice.level)
+        return min(active, key=lambda voice: voice.started)
+
+    def allocate(self, note, make_voice):
+        # make_voice(victim) tworzy glos; victim pozwala przejac np. kanal skradzionego glosu
+        victim = None
+        active = self.active()
+        while active and len(active) >= self.max_voices:
+            victim = self.choose_victim(active, note)
+            victim.kill()
+            active.remove(victim)
+            self.stolen += 1
+        voice = make_voice(victim)
+        if voice is None:
+            return None
+        voice.started = self._serial
+        self._serial += 1
+        self.voices.append(voice)
+        self.peak = max(self.peak, len(active) + 1)
+        return voice
+
+    def release(self, note, *args):
+        for voice in self.voices:
+            if voice.note == note and not voice.killed and not voice.releasing:
+                voice.release(*args)
+
+    def reap(self):
+        self.voices = [voice for voice in self.voices if not voice.finished]
+
+
+class StreamingEngine:
+    # Synteza blokami w callbacku audio: pamiec zalezy od liczby glosow, nie od zakresu nut,
+    # a zmiany params slychac od nastepnego bloku
+    def __init__(self, synth, params_source, block_size=256):
+        self.synth = synth
+        self.params_source = params_source
+        self.sample_rate = synth.sample_rate
+        self.block_size = block_size
+        self.gain = 0.8
+        # False: blok bez obcinania do [-1, 1] (partie bounce, miksowane i obcinane raz na koncu)
+        self.clip = True
+        self.pool = VoicePool()
+        self.chorus = Chorus(self.sample_rate)
+        self.chorus_active = False
+        self.events = deque()
+        self.tracer = None
+
+    def note_on(self, note, velocity, timestamp=None, make_voice=None):
+        # make_voice(note, velocity) pozwala podac inny glos niz SynthVoice (np. SampleVoice)
+        self.events.append((True, note, velocity, timestamp, make_voice))
+
+    def note_off(self, note):
+        self.events.append((False, note, 0, None, None))
+
+    def _dispatch(self):
+        while self.events:
+            on, note, velocity, timestamp, make_voice = self.events.popleft()
+            if on:
+                make_voice = make_voice or (lambda note, velocity: SynthVoice(note, velocity, self.sample_rate))
+                voice = self.pool.allocate(note, lambda victim: make_voice(note, velocity))
+                if voice is not None and self.tracer and timestamp is not None:
+                    self.tracer.record('voice_start', timestamp)
+                    voice.trace = timestamp
+            else:
+                self.pool.release(note)
+
+    def render(self, frames):
+        # Zwracany blok (frames, 2) float32 to bufor roboczy, wazny do nastepnego wywolania
+        self._dispatch()
+        params = self.params_source()
+        work = self.synth.work
+        mix = work.get('stream_mix', (frames,))
+        mix.fill(0)
+        for voice in self.pool.voices:
+            mix += voice.render(self.synth, params, frames)
+        block = work.get('stream_block', (frames, 2))
+        if params.get('chorus_depth', 0.0) > 0:
+            # Chorus na sumie glosow: jedna linia opozniajaca niezaleznie od polifonii, a ogon
+            # chorusu nie urywa sie, gdy glos zostaje zwolniony
+            self.chorus_active = True
+            # Chorus pisze prosto w blok przez transpozycje, bez bufora (2, frames) per dlugosc bloku
+            self.chorus.process(mix, params['chorus_depth'], params.get('chorus_rate', 0.0),
+                                params.get('chorus_mix', 0.5), out=block.T)
+        else:
+            if self.chorus_active:
+                self.chorus.reset()
+                self.chorus_active = False
+            block[:, 0] = mix
+            block[:, 1] = mix
+        block *= self.gain
+        if self.clip:
+            np.clip(block, -1, 1, out=block)
+        if self.tracer:
+            # Pierwszy blok glosu oddany do urzadzenia; wyjscie szacujemy o dlugosc bloku pozniej
+            now = time.perf_counter()
+            for voice in self.pool.voices:
+                if voice.trace is not None:
+                    self.tracer.record('buffer_submit', voice.trace, now)
+                    self.tracer.record('output', voice.trace, now + frames / self.sample_rate)
+                    voice.trace = None
+        self.pool.reap()
+        return block
+
+
+class AudioOutput:
+    # Wylot dla StreamingEngine z konfigurowalnym rozmiarem bloku i formatem probek. engine.render
+    # daje (ramki, 2) float32; pull() konwertuje do formatu wyjscia i mierzy czas renderu bloku
+    name = None
+
+    def __init__(self, engine, block_size=256, sample_format='float32'):
+        self.engine = engine
+        self.sample_rate = engine.sample_rate
+        self.block_size = block_size
+        self.sample_format = sample_format
+        self.dtype = np.dtype(SAMPLE_FORMATS[sample_format])
+        self.frame_bytes = 2 * self.dtype.itemsize
+        self.pcm = np.empty((block_size, 2), self.dtype)
+        self.timing = deque(maxlen=4096)
+        self.blocks = 0
+        self.frames_out = 0
+        self.overruns = 0
+
+    def pull(self, frames):
+        start = time.perf_counter()
+        block = self.engine.render(frames)
+        if len(self.pcm) < frames:
+            self.pcm = np.empty((frames, 2), self.dtype)
+        pcm = self.pcm[:frames]
+        if self.dtype == np.int16:
+            np.multiply(block, 32767, out=pcm, casting='unsafe')
+        else:
+            pcm[...] = block
+        took = time.perf_counter() - start
+        self.timing.append(took / frames)
+        self.blocks += 1
+        self.frames_out += frames
+        if took > frames / self.sample_rate:
+            self.overruns += 1
+        return pcm
+
+    def stats_text(self):
+        if not self.timing:
+            return f"{self.name}: no blocks yet"
+        # czas renderu przeliczony na blok o rozmiarze block_size, budzet to dlugosc bloku
+        times = np.array(self.timing) * self.block_size * 1000
+        budget = self.block_size / self.sample_rate * 1000
+        return (f"{self.name} {self.sample_rate} Hz {self.sample_format}, block {self.block_size}: "
+                f"{self.blocks} blocks, render mean {times.mean():.3f} ms, p99 {np.percentile(times, 99):.3f} ms, "
+                f"max {times.max():.3f} ms of {budget:.2f} ms ({times.mean() / budget * 100:.0f}% load), "
+                f"{self.overruns} overruns")
+
+    def pause(self, paused):
+        # Wylot bez urzadzenia ani watku nie ma czego wstrzymywac; podklasy nadpisuja
+        pass
+
+    def close(self):
+        self.pause(1)
+
+
+class SdlDeviceOutput(AudioOutput):
+    # Urzadzenie SDL2 z callbackiem: blok liczony w watku audio SDL
+    name = 'pygame'
+
+    def __init__(self, engine, block_size=256, sample_format='float32'):
+        super().__init__(engine, block_size, sample_format)
+        from pygame._sdl2 import audio as sdl2_audio
+        self.device = sdl2_audio.AudioDevice(
+            devicename=sdl2_audio.get_audio_device_names(False)[0], iscapture=False,
+            frequency=self.sample_rate,
+            audioformat=sdl2_audio.AUDIO_F32 if sample_format == 'float32' else sdl2_audio.AUDIO_S16,
+            numchannels=2, chunksize=block_size, allowed_changes=0, callback=self.callback)
+
+    def callback(self, device, stream):
+        stream[:] = memoryview(self.pull(len(stream) // self.frame_bytes)).cast('B')
+
+    def pause(self, paused):
+        self.device.pause(paused)
+
+    def close(self):
+        self.device.close()
+
+
+class ThreadedOutput(AudioOutput):
+    # Wylot z wlasnym watkiem: bloki po frames ramek, w tempie czasu rzeczywistego wg zegara
+    # wirtualnego (kolejne terminy co okres bloku, bez dryfu od czasu renderu) albo bez pauz
+    def __init__(self, engine, block_size=256, sample_format='float32', realtime=True, blocks_per_chunk=1):
+        super().__init__(engine, block_size, sample_format)
+        self.frames = block_size * blocks_per_chunk
+        self.realtime = realtime
+        self.running = False
+        self.thread = None
+
+    def deliver(self, pcm):
+        pass
+
+    def _run(self):
+        period = self.frames / self.sample_rate
+        deadline = time.perf_counter()
+        while self.running:
+            if self.realtime:
+                deadline += period
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.deliver(self.pull(self.frames))
+
+    def run_for(self, seconds):
+        # Render synchroniczny bez pauz: powtarzalny pomiar kosztu silnika (np. w CI)
+        for _ in range(int(np.ceil(seconds * self.sample_rate / self.frames))):
+            self.deliver(self.pull(self.frames))
+
+    def pause(self, paused):
+        if not paused and not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name=f"audio-{self.name}", daemon=True)
+            self.thread.start()
+        elif paused:
+            self.running = False
+
+    def close(self):
+        self.pause(1)
+        if self.thread:
+            self.thread.join()
+
+
+class MixerQueueOutput(ThreadedOutput):
+    # Zastepczy wylot dla StreamingEngine: watek dokleja bloki do kolejki kanalu pygame.mixer
+    # (mikser pracuje w int16, niezaleznie od formatu strumienia)
+    name = 'pygame-mixer'
+
+    def __init__(self, engine, block_size=256, blocks_per_chunk=4):
+        super().__init__(engine, block_size, 'int16', blocks_per_chunk=blocks_per_chunk)
+        pygame.mixer.set_reserved(1)
+        self.channel = pygame.mixer.Channel(0)
+
+    def _run(self):
+        period = self.frames / self.sample_rate
+        while self.running:
+            if self.channel.get_queue() is None:
+                sound = pygame.mixer.Sound(self.pull(self.frames))
+                if self.channel.get_busy():
+                    self.channel.queue(sound)
+                else:
+                    self.channel.play(sound)
+            time.sleep(period / 4)
+
+
+class NullOutput(ThreadedOutput):
+    # Bez urzadzenia: bloki sa liczone i wyrzucane, zostaja tylko pomiary czasu renderu
+    name = 'null'
+
+
+class FileOutput(ThreadedOutput):
+    # Strumien zapisywany do WAV (int16 albo float32) zamiast na karte dzwiekowa
+    name = 'file'
+
+    def __init__(self, engine, path, block_size=256, sample_format='float32', realtime=True):
+        super().__init__(engine, block_size, sample_format, realtime)
+        self.path = path
+        self.writer = WavWriter(path, self.sample_rate, sample_format=sample_format)
+
+    def deliver(self, pcm):
+        self.writer.write_pcm(pcm)
+
+    def close(self):
+        super().close()
+        self.writer.close()
+
+
+def open_output(backend, engine, block_size=256, sample_format='float32', path=None, realtime=True):
+    if backend == 'pygame':
+        try:
+            return SdlDeviceOutput(engine, block_size, sample_format)
+        except Exception as e:
+            # Sterownik bez drugiego urzadzenia: bloki leca do zarezerwowanego kanalu miksera
+            print(f"Streaming audio device unavailable ({str(e)}), using mixer channel queue")
+            return MixerQueueOutput(engine, block_size)
+    if backend == 'file':
+        return FileOutput(engine, path or AUDIO_DEFAULTS['path'], block_size, sample_format, realtime)
+    if backend == 'null':
+        return NullOutput(engine, block_size, sample_format, realtime)
+    raise ValueError(f"unknown audio backend: {backend}")
+
+
+def scope_points(samples, width, height):
+    # Punkty linii oscyloskopu jako tablica (n, 2); przy wiekszej liczbie probek niz 2 na piksel
+    # kazda kolumna dostaje min i max swojego przedzialu, wiec koszt rysowania to O(width)
+    samples = np.asarray(samples, dtype=np.float64)
+    columns = max(1, int(width))
+    if len(samples) > 2 * columns:
+        edges = np.linspace(0, len(samples), columns + 1).astype(np.intp)
+        lows = np.minimum.reduceat(samples, edges[:-1])
+        highs = np.maximum.reduceat(samples, edges[:-1])
+        ys = np.empty(2 * columns)
+        ys[0::2] = lows
+        ys[1::2] = highs
+        xs = np.repeat(np.arange(columns) * (width / columns), 2)
+    else:
+        ys = samples
+        xs = np.arange(len(samples)) * (width / max(1, len(samples)))
+    points = np.empty((len(ys), 2))
+    points[:, 0] = xs
+    points[:, 1] = height / 2 - ys * (height / 2)
+    return points
+
+
+def polygon_from_array(points):
+    # QPolygonF wypelniony bezposrednio przez bufor sip, bez petli po QPointF
+    polygon = QPolygonF()
+    polygon.resize(len(points))
+    buffer = polygon.data()
+    buffer.setsize(len(points) * 2 * 8)
+    np.frombuffer(buffer, dtype=np.float64).reshape(-1, 2)[:] = points
+    return polygon
+
+
+class PreviewRenderer(QObject):
+    # Render podgladu w watku roboczym: trzymamy tylko najnowsze zlecenie, starsze sa porzucane,
+    # a wynik wraca do watku GUI przez sygnal
+    ready = pyqtSignal(object)
+
+    def __init__(self, engine, length=2000):
+        super().__init__()
+        self.engine = engine
+        self.length = length
+        self.generation = 0
+        self._job = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, params):
+        with self._condition:
+            self.generation += 1
+            self._job = (self.generation, dict(params))
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._job is None:
+                    self._condition.wait()
+                generation, params = self._job
+                self._job = None
+            try:
+                wave = self.engine.generate_wave(params, length=self.length)
+            except Exception as e:
+                print(f"Error rendering preview: {str(e)}")
+                continue
+            if generation == self.generation:
+                self.ready.emit(wave)
+
+
+class LatencyTracer:
+    # Opoznienia od przyjecia komunikatu MIDI (perf_counter w callbacku rtmidi) do kolejnych etapow;
+    # trzymamy ostatnie `window` pomiarow na etap i liczymy z nich p50/p99/max
+    stages = ('dispatch', 'voice_start', 'buffer_submit', 'output')
+
+    def __init__(self, window=2048):
+        self.samples = {stage: deque(maxlen=window) for stage in self.stages}
+
+    def record(self, stage, ingest_time, now=None):
+        if ingest_time is None:
+            return
+        if now is None:
+            now = time.perf_counter()
+        self.samples[stage].append((now - ingest_time) * 1000)
+
+    def reset(self):
+        for samples in self.samples.values():
+            samples.clear()
+
+    def stats(self):
+        result = {}
+        for stage, samples in self.samples.items():
+            values = np.array(samples)
+            if len(values):
+                result[stage] = {'count': len(values), 'p50_ms': float(np.percentile(values, 50)),
+                                 'p99_ms': float(np.percentile(values, 99)), 'max_ms': float(values.max())}
+            else:
+                result[stage] = {'count': 0, 'p50_ms': None, 'p99_ms': None, 'max_ms': None}
+        return result
+
+    def summary_text(self):
+        lines = []
+        for stage, stat in self.stats().items():
+            if stat['count']:
+                lines.append(f"{stage}: p50 {stat['p50_ms']:.2f} ms, p99 {stat['p99_ms']:.2f} ms, "
+                             f"max {stat['max_ms']:.2f} ms (n={stat['count']})")
+            else:
+                lines.append(f"{stage}: no data")
+        return "\n".join(lines)
+
+    def export_json(self, filename, **context):
+        with open(filename, 'w') as f:
+            json.dump({'stats': self.stats(), 'context': context,
+                       'samples_ms': {stage: list(samples) for stage, samples in self.samples.items()}},
+                      f, indent=4)
+
+
+class MidiRing:
+    # Bufor cykliczny jeden producent (watek rtmidi) / jeden konsument (dispatcher): producent
+    # przesuwa tylko head, konsument tylko tail, wiec nie potrzeba blokad
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+    def push(self, status, data1, data2, timestamp):
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.dropped += 1
+            return False
+        self.slots[head % self.capacity] = (status, data1, data2, timestamp)
+        self.head = head + 1
+        return True
+
+    def pop(self):
+        tail = self.tail
+        if tail == self.head:
+            return None
+        event = self.slots[tail % self.capacity]
+        self.tail = tail + 1
+        return event
+
+    def __len__(self):
+        return self.head - self.tail
+
+
+class MidiDispatcher:
+    # Oproznia MidiRing we wlasnym watku i wola note_on/note_off; GUI tylko czyta last_event
+    def __init__(self, ring, note_on, note_off, interval=0.001, tracer=None):
+        self.ring = ring
+        self.tracer = tracer
+        self.note_on = note_on
+        self.note_off = note_off
+        self.interval = interval
+        self.last_event = None
+        self.count = 0
+        self.running = False
+        self.thread = None
+
+    def drain(self):
+        drained = 0
+        while True:
+            event = self.ring.pop()
+            if event is None:
+                break
+            status, note, velocity, timestamp = event
+            kind = status & 0xF0
+            if kind == 0x90 and velocity > 0:
+                if self.tracer:
+                    self.tracer.record('dispatch', timestamp)
+                self.note_on(note, velocity, timestamp)
+            elif kind == 0x80 or kind == 0x90:
+                self.note_off(note)
+            self.last_event = event
+            drained += 1
+        self.count += drained
+        return drained
+
+    def _run(self):
+        while self.running:
+            if not self.drain():
+                time.sleep(self.interval)
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+
+class UiTelemetry:
+    # Stan dla GUI zapisywany z watkow MIDI/silnika bez dotykania Qt: trzymane klawisze i ostatni
+    # status nuty. GUI bierze migawke w stalym rytmie klatek i odswieza tylko to, co sie zmienilo
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.held = np.zeros(128, dtype=bool)
+        self.status = None
+        self.serial = 0
+
+    def note(self, kind, note, detail=None):
+        with self.lock:
+            if kind == 'play':
+                self.held[note] = True
+            elif kind == 'stop':
+                self.held[note] = False
+            self.status = (kind, note, detail)
+            self.serial += 1
+
+    def snapshot(self):
+        with self.lock:
+            return self.serial, self.held.copy(), self.status
+
+
+def render_key(params, freq, sample_rate, duration):
+    params = {k: v for k, v in params.items() if k != 'frequency'}
+    blob = json.dumps({'params': params, 'freq': round(float(freq), 6), 'rate': sample_rate,
+                       'duration': duration, 'version': ENGINE_VERSION}, sort_keys=True)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+class RenderCache:
+    # Cache renderow na dysku: klucz to hash (params, czestotliwosc, sample rate, wersja silnika),
+    # wartosc to plik .npy z mono int16 ladowany przez mmap; LRU wg czasu ostatniego uzycia
+    def __init__(self, directory="render_cache", budget_mb=512):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.budget = budget_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}
+        if os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                if entry.name.endswith('.npy'):
+                    stat = entry.stat()
+                    self._entries[entry.name[:-4]] = [stat.st_size, stat.st_mtime]
+
+    def key(self, params, freq, sample_rate, duration):
+        return render_key(params, freq, sample_rate, duration)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key):
+        if key in self._entries:
+            try:
+                data = np.load(self.path(key), mmap_mode='r')
+            except (OSError, ValueError):
+                self._entries.pop(key, None)
+            else:
+                now = time.time()
+                self._entries[key][1] = now
+                os.utime(self.path(key), (now, now))
+                self.hits += 1
+                return data
+        self.misses += 1
+        return None
+
+    def put(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock:
+            tmp = self.path(key) + '.tmp'
+            with open(tmp, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp, self.path(key))
+            self._entries[key] = [os.path.getsize(self.path(key)), time.time()]
+            self.evict()
+
+    def size(self):
+        return sum(size for size, _ in self._entries.values())
+
+    def evict(self):
+        total = self.size()
+        if total <= self.budget:
+            return
+        for key, (size, _) in sorted(self._entries.items(), key=lambda item: item[1][1]):
+            if total <= self.budget:
+                break
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+            del self._entries[key]
+            total -= size
+            self.evictions += 1
+
+    def stats_text(self):
+        # Wolane z GUI, gdy watek dogrzewania moze wlasnie dopisywac wpisy
+        with self.lock:
+            size = self.size()
+            count = len(self._entries)
+        return (f"Render cache: {self.hits} hits / {self.misses} misses, "
+                f"{count} entries, {size / (1024 * 1024):.1f} MB"
+                f" (evicted {self.evictions})")
+
+
+class SoundStore:
+    # Dzwieki nut renderowane przy pierwszym uzyciu (source(note) -> mono int16 albo None),
+    # trzymane jako mono w LRU z budzetem pamieci; stereo powstaje dopiero przy odtwarzaniu.
+    # Sasiednie nuty sa dogrzewane w watku w tle, najblizsze najpierw
+    def __init__(self, budget_mb=64, warm_radius=2):
+        self.budget = budget_mb * 1024 * 1024
+        self.warm_radius = warm_radius
+        self.source = None
+        self.generation = 0
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.warmed = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.pending = {}
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def reset(self, source=None):
+        with self.lock:
+            self.source = source
+            self.generation += 1
+            self.entries.clear()
+            self.pending = {}
+            self.bytes = 0
+        with self._condition:
+            self._queue.clear()
+
+    def set_budget(self, budget_mb):
+        with self.lock:
+            self.budget = budget_mb * 1024 * 1024
+            self._evict()
+
+    def get(self, note, warm=True):
+        with self.lock:
+            data = self.entries.get(note)
+            if data is not None:
+                self.entries.move_to_end(note)
+                self.hits += 1
+            elif self.source is not None:
+                self.misses += 1
+            generation = self.generation
+        if data is None:
+            data = self._render(note)
+        if data is not None and warm:
+            self.warm(note, generation)
+        return data
+
+    def warm(self, note, generation=None):
+        neighbours = [note + sign * step for step in range(1, self.warm_radius + 1) for sign in (1, -1)]
+        with self._condition:
+            self._queue.extend((generation or self.generation, n) for n in neighbours if 0 <= n <= 127)
+            self._condition.notify()
+
+    def _render(self, note, cold=False):
+        # Render poza lockiem (lock chroni tylko slownik i liczniki bajtow), wiec trafienia w cache
+        # nie czekaja na render sasiada; drugie zadanie o te sama nute czeka na pierwszy render.
+        # Dogrzane nuty trafiaja na zimny koniec LRU, zeby spekulacja nie wypychala granych nut
+        with self.lock:
+            data = self.entries.get(note)
+            if data is not None or self.source is None:
+                return data
+            flight = self.pending.get(note)
+            owner = flight is None
+            if owner:
+                flight = self.pending[note] = {'done': threading.Event(), 'data': None}
+                source, generation = self.source, self.generation
+        if not owner:
+            flight['done'].wait()
+            return flight['data']
+        data = None
+        try:
+            data = source(note)
+        finally:
+            with self.lock:
+                if self.pending.get(note) is flight:
+                    del self.pending[note]
+                if data is not None and generation == self.generation and note not in self.entries:
+                    self.entries[note] = data
+                    if cold:
+                        self.entries.move_to_end(note, last=False)
+                    self.bytes += data.nbytes
+                    self._evict()
+            flight['data'] = data
+            flight['done'].set()
+        return data
+
+    def _evict(self):
+        while self.bytes > self.budget and len(self.entries) > 1:
+            _, data = self.entries.popitem(last=False)
+            self.bytes -= data.nbytes
+            self.evictions += 1
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                generation, note = self._queue.popleft()
+            with self.lock:
+                if (generation != self.generation or self.source is None or note in self.entries
+                        or note in self.pending):
+                    continue
+            try:
+                if self._render(note, cold=True) is not None:
+                    self.warmed += 1
+            except Exception as e:
+                print(f"Error warming note {note}: {str(e)}")
+
+    def stats_text(self):
+        return (f"Sounds: {len(self.entries)} notes, {self.bytes / (1024 * 1024):.1f} / "
+                f"{self.budget / (1024 * 1024):.0f} MB, {self.hits} hits / {self.misses} misses, "
+                f"{self.warmed} warmed, {self.evictions} evicted")
+
+
+PRESET_EFFECT_TAGS = {
+    'freq_mod': 'fm', 'amp_mod': 'am', 'vibrato_depth': 'vibrato', 'tremolo_depth': 'tremolo',
+    'noise_level': 'noise', 'distortion': 'distortion', 'bit_crush': 'bit_crush',
+    'fold_amount': 'fold', 'chorus_depth': 'chorus',
+}
+
+
+def preset_tags(params):
+    tags = {params.get('wave_shape1', 'sine'), params.get('wave_shape2', 'sine')}
+    tags.update(tag for param, tag in PRESET_EFFECT_TAGS.items() if params.get(param, 0.0) > 0)
+    if params.get('filter_cutoff', 20000) < 20000:
+        tags.add(params.get('filter_mode', 'lowpass'))
+    return sorted(tags)
+
+
+class PresetStore:
+    # Presety jako pliki <nazwa>.json plus indeks .index.json (mtime, rozmiar, hash params, tagi).
+    # Przy skanowaniu czytamy tylko pliki, ktorych mtime/rozmiar sie zmienil; tresc presetu
+    # ladowana dopiero przy wyborze
+    index_name = ".index.json"
+
+    def __init__(self, directory="presets"):
+        self.directory = directory
+        self.index = {}
+        self.bodies = {}
+        index_path = os.path.join(directory, self.index_name)
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r') as f:
+                    self.index = json.load(f).get('presets', {})
+            except Exception as e:
+                print(f"Error loading preset index: {str(e)}")
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+
+    def names(self, tag=None):
+        return sorted(name for name, entry in self.index.items() if tag is None or tag in entry['tags'])
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, name):
+        body = self.bodies.get(name)
+        if body is None:
+            with open(self.path(name), 'r') as f:
+                body = self.bodies[name] = json.load(f)
+        return body
+
+    def _entry(self, name, params, stat):
+        digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+        return {'mtime': stat.st_mtime, 'size': stat.st_size, 'hash': digest, 'tags': preset_tags(params)}
+
+    def stat_files(self):
+        # Tylko scandir + stat, bez stanu sklepu, wiec mozna wolac z watku w tle; None bez katalogu
+        if not os.path.isdir(self.directory):
+            return None
+        files = {}
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json") and entry.name != self.index_name:
+                stat = entry.stat()
+                files[entry.name[:-5]] = (stat.st_mtime, stat.st_size)
+        return files
+
+    def scan(self, files=None):
+        # Porownujemy mtime/rozmiar kazdego pliku: nadpisanie presetu w miejscu nie zmienia mtime
+        # katalogu. files: gotowy wynik stat_files() (np. z watku w tle), czytamy tylko zmienione pliki
+        if files is None:
+            files = self.stat_files()
+        if files is None:
+            return [], []
+        changed = []
+        for name, (mtime, size) in files.items():
+            known = self.index.get(name)
+            if known and known['mtime'] == mtime and known['size'] == size:
+                continue
+            try:
+                with open(self.path(name), 'r') as f:
+                    params = json.load(f)
+                stat = os.stat(self.path(name))
+            except Exception as e:
+                print(f"Error loading preset {name}.json: {str(e)}")
+                continue
+            self.index[name] = self._entry(name, params, stat)
+            self.bodies.pop(name, None)
+            changed.append(name)
+        # Preset zapisany po zrobieniu migawki files jeszcze w niej nie ma, ale plik istnieje
+        removed = [name for name in self.index if name not in files and not os.path.exists(self.path(name))]
+        for name in removed:
+            del self.index[name]
+            self.bodies.pop(name, None)
+        if changed or removed:
+            self.write_index()
+        return changed, removed
+
+    def write_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        index_path = os.path.join(self.directory, self.index_name)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump({'version': 1, 'presets': self.index}, f, separators=(',', ':'), sort_keys=True)
+        os.replace(index_path + '.tmp', index_path)
+
+    def save(self, name, params, write_index=True):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(name), 'w') as f:
+            json.dump(params, f, indent=4)
+        self.index[name] = self._entry(name, params, os.stat(self.path(name)))
+        self.bodies[name] = dict(params)
+        if write_index:
+            self.write_index()
+
+    def import_file(self, filename):
+        # Kazdy preset z pliku zbiorczego trafia na dysk jako osobny plik; indeks zapisujemy raz
+        with open(filename, 'r') as f:
+            presets = json.load(f)
+        for name, params in presets.items():
+            self.save(name, params, write_index=False)
+            self.bodies.pop(name, None)
+        self.write_index()
+        return list(presets)
+
+    def export_file(self, filename):
+        # Zapis strumieniowy, preset po presecie, bez skladania calosci w pamieci
+        with open(filename, 'w') as f:
+            f.write("{")
+            for i, name in enumerate(self.names()):
+                body = self.bodies.get(name)
+                if body is None:
+                    with open(self.path(name), 'r') as preset_file:
+                        body = json.load(preset_file)
+                f.write(("," if i else "") + f"\n    {json.dumps(name)}: {json.dumps(body)}")
+            f.write("\n}\n")
+
+
+def random_patch(rng=random, shapes=('sine', 'square', 'sawtooth', 'triangle', 'noise', 'custom')):
+    # Losowy patch w tych samych zakresach co przycisk Randomize
+    patch = {}
+    for param in DEFAULT_PARAMS:
+        if param in ['wave_shape1', 'wave_shape2']:
+            patch[param] = rng.choice(shapes)
+        elif param == 'filter_mode':
+            patch[param] = rng.choice(FILTER_MODES)
+        else:
+            max_val = 1.0 if any(x in param for x in ['weight', 'level', 'depth', 'mix', 'amount', 'resonance']) else \
+                      Chorus.MAX_RATE if param == 'chorus_rate' else \
+                      2.0 if 'time' in param else 20000 if 'cutoff' in param else \
+                      2000 if 'freq' in param or 'rate' in param else 1.0
+            patch[param] = rng.uniform(0, max_val)
+    return patch
+
+
+class SpectralFeatures:
+    # Odcisk barwy patcha: render jednej nuty i cechy liczone wektorowo dla calej paczki
+    # (wiersze = patche): centroid, rolloff, plaskosc widma, udzialy harmonicznych, obwiednia RMS
+    version = 1
+    harmonics = 8
+    envelope_points = 12
+
+    def __init__(self, sample_rate=22050, duration=0.5, note=57):
+        self.engine = SynthEngine(sample_rate, duration)
+        self.sample_rate = sample_rate
+        self.freq = float(note_to_freq(note))
+        self.frames = len(self.engine.t)
+        self.window = np.hanning(self.frames).astype(np.float32)
+        self.bins = np.fft.rfftfreq(self.frames, 1 / sample_rate).astype(np.float32)
+        # Okno +-3 biny wokol kazdej harmonicznej ponizej Nyquista
+        centers = np.rint(self.freq * np.arange(1, self.harmonics + 1) * self.frames / sample_rate).astype(np.intp)
+        self.harmonic_bins = np.clip(centers[:, np.newaxis] + np.arange(-3, 4), 0, len(self.bins) - 1)
+        self.harmonic_valid = centers < len(self.bins) - 3
+        self.dims = 3 + self.harmonics + 1 + self.envelope_points
+
+    def render(self, patches, out=None):
+        if out is None:
+            out = np.empty((len(patches), self.frames), np.float32)
+        for row, params in enumerate(patches):
+            # Staly zarodek szumu, zeby ten sam patch dawal zawsze te same cechy
+            self.engine.rng = np.random.default_rng(0)
+            self.engine.generate_batch(params, [self.freq], out=out[row:row + 1])
+        np.nan_to_num(out, copy=False)
+        return out
+
+    def extract(self, waves):
+        power = np.fft.rfft(waves * self.window, axis=1)
+        power = (power.real ** 2 + power.imag ** 2).astype(np.float32)
+        total = power.sum(axis=1) + 1e-12
+        centroid = power @ self.bins / total
+        rolloff = self.bins[np.argmax(np.cumsum(power, axis=1) >= 0.85 * total[:, np.newaxis], axis=1)]
+        flatness = np.exp(np.log(power + 1e-12).mean(axis=1)) / (total / power.shape[1])
+        harmonic = power[:, self.harmonic_bins].sum(axis=2) * self.harmonic_valid / total[:, np.newaxis]
+        inharmonic = np.clip(1 - harmonic.sum(axis=1), 0, 1)
+
+        usable = self.frames - self.frames % self.envelope_points
+        envelope = np.sqrt((waves[:, :usable] ** 2).reshape(len(waves), self.envelope_points, -1).mean(axis=2))
+        envelope /= envelope.max(axis=1, keepdims=True) + 1e-12
+
+        # Skale dobrane tak, by kazda grupa cech miala podobny zakres (okolo 0..1)
+        return np.column_stack([
+            np.log2(np.maximum(centroid, 1.0) / self.freq) / 8,
+            np.log2(np.maximum(rolloff, 1.0) / self.freq) / 8,
+            flatness,
+            np.sqrt(harmonic),
+            inharmonic,
+            envelope,
+        ]).astype(np.float32)
+
+    def analyze(self, patches, batch_size=64):
+        patches = list(patches)
+        result = np.empty((len(patches), self.dims), np.float32)
+        buffer = np.empty((min(batch_size, len(patches)), self.frames), np.float32)
+        for start in range(0, len(patches), batch_size):
+            chunk = patches[start:start + batch_size]
+            result[start:start + len(chunk)] = self.extract(self.render(chunk, buffer[:len(chunk)]))
+        return result
+
+
+class FeatureIndex:
+    # Cechy presetow (klucz = hash params z PresetStore) i losowych patchy w jednym .npz obok
+    # presetow; najblizszych sasiadow szuka cKDTree budowane ponownie tylko po zmianie
+    file_name = ".features.npz"
+
+    def __init__(self, directory="presets", analyzer=None):
+        self.path = os.path.join(directory, self.file_name)
+        self.analyzer = analyzer or SpectralFeatures()
+        self.names = []
+        self.keys = []
+        self.patches = {}
+        self.features = np.zeros((0, self.analyzer.dims), np.float32)
+        self._tree = None
+        if os.path.exists(self.path):
+            try:
+                with np.load(self.path) as data:
+                    if int(data['version']) == self.version_key():
+                        self.names = [str(name) for name in data['names']]
+                        self.keys = [str(key) for key in data['keys']]
+                        self.patches = json.loads(str(data['patches']))
+                        self.features = data['features']
+            except Exception as e:
+                print(f"Error loading feature index: {str(e)}")
+
+    def version_key(self):
+        return ENGINE_VERSION * 1000 + self.analyzer.version
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.patches or name in self.names
+
+    def update(self, store):
+        # Liczy cechy tylko dla presetow nowych albo zmienionych; usuniete presety wypadaja
+        wanted = {name: store.index[name]['hash'] for name in store.names()}
+        keep = [row for row, (name, key) in enumerate(zip(self.names, self.keys))
+                if name in self.patches or wanted.get(name) == key]
+        have = {self.names[row] for row in keep}
+        stale = [name for name in wanted if name not in have]
+        if len(keep) != len(self.names) or stale:
+            self.names = [self.names[row] for row in keep]
+            self.keys = [self.keys[row] for row in keep]
+            self.features = self.features[keep]
+            self._append(stale, [wanted[name] for name in stale], [store[name] for name in stale])
+        return len(stale), len(keep)
+
+    def add_patches(self, patches):
+        # patches: {nazwa: params}; params zapisujemy w indeksie, bo patch nie ma pliku presetu
+        self.patches.update(patches)
+        self._append(list(patches), [""] * len(patches), list(patches.values()))
+
+    def _append(self, names, keys, patches):
+        if not names:
+            return
+        features = self.analyzer.analyze(patches)
+        self.names += names
+        self.keys += keys
+        self.features = np.concatenate([self.features, features])
+        self._tree = None
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, version=self.version_key(), names=np.array(self.names, dtype=str),
+                     keys=np.array(self.keys, dtype=str), patches=json.dumps(self.patches),
+                     features=self.features)
+        os.replace(temp_path, self.path)
+
+    def tree(self):
+        if self._tree is None:
+            self._tree = spatial.cKDTree(self.features)
+        return self._tree
+
+    def nearest(self, features, k=10, exclude=None):
+        if not self.names:
+            return []
+        count = min(k + 1, len(self.names))
+        distances, rows = self.tree().query(features, count)
+        results = [(self.names[row], float(distance))
+                   for distance, row in zip(np.atleast_1d(distances), np.atleast_1d(rows)) if self.names[row] != exclude]
+        return results[:k]
+
+    def similar_to(self, params, k=10, exclude=None):
+        return self.nearest(self.analyzer.analyze([params])[0], k, exclude)
+
+    def params(self, name, store):
+        return self.patches[name] if name in self.patches else store[name]
+
+
+_worker_state = {}
+
+
+def _init_sample_worker(src_name, src_length, out_name, quality, sample_format='int16', kernels=None):
+    # Kazdy proces puli podpina sie raz do probki wejsciowej i bufora wynikowego; jadra
+    # przychodza policzone z procesu glownego
+    Resampler.install(kernels or {})
+    _worker_state['resampler'] = Resampler(quality)
+    _worker_state['format'] = sample_format
+    src = shared_memory.SharedMemory(name=src_name)
+    out = shared_memory.SharedMemory(name=out_name)
+    _worker_state['shm'] = (src, out)
+    _worker_state['data'] = np.ndarray((src_length,), dtype=np.float32, buffer=src.buf)
+    _worker_state['out'] = out.buf
+
+
+def _resample_note(offset, semitones):
+    resampled = _worker_state['resampler'].resample(_worker_state['data'], semitones)
+    new_length = len(resampled)
+    if _worker_state['format'] == 'float32':
+        np.ndarray((new_length,), dtype=np.float32, buffer=_worker_state['out'], offset=offset * 4)[:] = resampled
+        return offset
+    out = np.ndarray((new_length, 2), dtype=np.int16, buffer=_worker_state['out'], offset=offset * 4)
+    np.multiply(np.clip(resampled, -1, 1), 32767, out=resampled)
+    out[:, 0] = resampled
+    out[:, 1] = out[:, 0]
+    return offset
+
+
+class SampleRenderPool:
+    # Resampling nut rozlozony na pule procesow; wyniki wracaja przez pamiec wspoldzielona
+    # bez kopiowania przez pickle: stereo int16 dla pygame albo mono float32 dla bounce
+    # (oba po 4 bajty na ramke, wiec uklad bufora jest ten sam)
+    def __init__(self, workers=None, quality='draft', sample_format='int16', mp_context=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.quality = quality
+        self.sample_format = sample_format
+        self.mp_context = mp_context
+
+    def render(self, data, offsets, on_note):
+        # offsets: {nuta: przesuniecie w poltonach}; on_note(nuta, widok) dostaje widok na
+        # pamiec wspoldzielona, ktory jest wazny tylko w trakcie wywolania
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        resampler = Resampler(self.quality)
+        kernels = resampler.precompute(offsets.values())
+        lengths = {note: resampler.output_length(len(data), semitones) for note, semitones in offsets.items()}
+        positions = {}
+        total = 0
+        for note, length in lengths.items():
+            positions[note] = total
+            total += length
+
+        src = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        out = shared_memory.SharedMemory(create=True, size=max(total * 4, 1))
+        try:
+            np.ndarray(data.shape, dtype=np.float32, buffer=src.buf)[:] = data
+            with ProcessPoolExecutor(self.workers, mp_context=self.mp_context, initializer=_init_sample_worker,
+                                     initargs=(src.name, len(data), out.name, self.quality,
+                                               self.sample_format, kernels)) as pool:
+                futures = {pool.submit(_resample_note, positions[note], offsets[note]): note
+                           for note in offsets}
+                for future in as_completed(futures):
+                    future.result()
+                    note = futures[future]
+                    if self.sample_format == 'float32':
+                        view = np.ndarray((lengths[note],), dtype=np.float32, buffer=out.buf,
+                                          offset=positions[note] * 4)
+                    else:
+                        view = np.ndarray((lengths[note], 2), dtype=np.int16, buffer=out.buf,
+                                          offset=positions[note] * 4)
+                    on_note(note, view)
+                    del view
+        finally:
+            src.close()
+            src.unlink()
+            out.close()
+            out.unlink()
+
+
+def benchmark_sample_pool(seconds=10.0, notes=48, sample_rate=44100, quality='draft'):
+    data = np.random.uniform(-1, 1, int(seconds * sample_rate)).astype(np.float32)
+    offsets = {note: note - notes // 2 for note in range(notes)}
+    results = []
+    workers = 1
+    while True:
+        start = time.perf_counter()
+        SampleRenderPool(workers, quality).render(data, offsets, lambda note, view: None)
+        elapsed = time.perf_counter() - start
+        results.append((workers, elapsed))
+        print(f"workers={workers:3d}  {elapsed:7.3f} s  {notes / elapsed:8.1f} notes/s  "
+              f"speedup x{results[0][1] / elapsed:.2f}")
+        if workers >= (os.cpu_count() or 1):
+            break
+        workers = min(workers * 2, os.cpu_count() or 1)
+    return results
+
+
+# Benchmarki: DSP budowany bez QMainWindow i bez urzadzenia audio
+BENCH_EFFECTS = {
+    'base': {},
+    'freq_mod': {'freq_mod': 0.5, 'freq_mod_rate': 5.0},
+    'amp_mod': {'amp_mod': 0.5, 'amp_mod_rate': 5.0},
+    'vibrato': {'vibrato_depth': 0.5, 'vibrato_rate': 6.0},
+    'tremolo': {'tremolo_depth': 0.5, 'tremolo_rate': 6.0},
+    'noise': {'noise_level': 0.2},
+    'distortion': {'distortion': 0.5},
+    'bit_crush': {'bit_crush': 0.5},
+    'fold': {'fold_amount': 0.5},
+    'filter': {'filter_cutoff': 2000, 'filter_resonance': 0.5},
+    'chorus': {'chorus_depth': 0.5, 'chorus_rate': 2.0, 'chorus_mix': 0.5},
+    'square_saw': {'wave_shape1': 'square', 'wave_shape2': 'sawtooth'},
+}
+BENCH_EFFECTS['all'] = {k: v for effect in list(BENCH_EFFECTS.values()) for k, v in effect.items()}
+
+
+def time_call(func, repeats):
+    func()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    times = np.array(times)
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return {'median_ms': float(median), 'min_ms': float(times.min()), 'iqr_ms': float(q3 - q1)}
+
+
+def run_benchmarks(quick=False):
+    repeats = 3 if quick else 7
+    engine = SynthEngine()
+    samples = len(engine.t)
+    results = {}
+
+    def add(name, func, total_samples, notes=1):
+        stat = time_call(func, repeats)
+        stat['samples_per_s'] = total_samples / (stat['median_ms'] / 1000)
+        stat['ms_per_note'] = stat['median_ms'] / notes
+        results[name] = stat
+        print(f"{name:32s} {stat['median_ms']:9.2f} ms  (min {stat['min_ms']:8.2f}, iqr {stat['iqr_ms']:7.2f})  "
+              f"{stat['samples_per_s'] / 1e6:8.2f} Msamples/s  {stat['ms_per_note']:8.2f} ms/note")
+
+    for effect, overrides in BENCH_EFFECTS.items():
+        params = dict(DEFAULT_PARAMS, **overrides)
+        add(f"generate_wave/{effect}", lambda: engine.generate_wave(params), samples)
+    add("apply_adsr", lambda: engine.apply_adsr(DEFAULT_PARAMS), samples)
+
+    block_engine = StreamingEngine(engine, lambda: DEFAULT_PARAMS)
+    for note in range(60, 68):
+        block_engine.note_on(note, 100)
+    # 100 blokow po 256 ramek z 8 glosami: ms/note na glos, do tego ms na blok i zapas wzgledem czasu rzeczywistego
+    name = "stream/8 voices x 100 blocks"
+    add(name, lambda: [block_engine.render(256) for _ in range(100)], 25600, 8)
+    results[name]['ms_per_block'] = results[name]['median_ms'] / 100
+    results[name]['realtime_factor'] = 256 / engine.sample_rate * 1000 / results[name]['ms_per_block']
+    print(f"{'':32s} {results[name]['ms_per_block']:.3f} ms/block  x{results[name]['realtime_factor']:.1f} real time")
+
+    for count in ((12, 49) if quick else (12, 49, 128)):
+        notes = list(range(max(0, 60 - count // 2), max(0, 60 - count // 2) + count))
+        for effect in ('base', 'all'):
+            params = dict(DEFAULT_PARAMS, **BENCH_EFFECTS[effect])
+
+            def render_preset():
+                for chunk, waves in engine.render_notes(params, notes):
+                    for wave in waves:
+                        mono_to_int16_stereo(wave)
+            add(f"process_preset/{count} notes/{effect}", render_preset, samples * count, count)
+
+    pool = SampleRenderPool()
+    for seconds in ((1.0,) if quick else (1.0, 10.0)):
+        data = np.random.uniform(-1, 1, int(seconds * engine.sample_rate)).astype(np.float32)
+        for count in (12, 49):
+            offsets = {note: note - count // 2 for note in range(count)}
+            for quality in ('draft', 'high'):
+                pool.quality = quality
+                add(f"process_sample/{seconds:g}s/{count} notes/{quality}",
+                    lambda: pool.render(data, offsets, lambda note, view: None), len(data) * count, count)
+
+    # Skalowanie puli z liczba rdzeni: ta sama praca na 1, 2, 4, ... procesach
+    data = np.random.uniform(-1, 1, int((1.0 if quick else 10.0) * engine.sample_rate)).astype(np.float32)
+    offsets = {note: note - 24 for note in range(48)}
+    cores = os.cpu_count() or 1
+    workers = 1
+    while True:
+        name = f"sample_pool/{workers} workers"
+        add(name, lambda: SampleRenderPool(workers).render(data, offsets, lambda note, view: None),
+            len(data) * len(offsets), len(offsets))
+        results[name]['speedup'] = results["sample_pool/1 workers"]['median_ms'] / results[name]['median_ms']
+        print(f"{'':32s} speedup x{results[name]['speedup']:.2f} on {workers} of {cores} cores")
+        if workers >= cores:
+            break
+        workers = min(workers * 2, cores)
+
+    # Keymapa: kazda nuta jak w bounce, glos SampleVoice czytany blokami az do konca probki
+    for seconds in ((1.0,) if quick else (1.0, 10.0)):
+        data = np.random.uniform(-1, 1, int(seconds * engine.sample_rate)).astype(np.float32)
+        zone = SampleZone(MemorySample(data, engine.sample_rate), 60)
+        for count in (12, 49):
+            notes = list(range(60 - count // 2, 60 - count // 2 + count))
+            steps = [zone.step(note, engine.sample_rate) for note in notes]
+            frames = sum(int(len(data) / step) for step in steps)
+            for quality in ('draft', 'high'):
+                def render_keymap():
+                    for note, step in zip(notes, steps):
+                        voice = SampleVoice(note, 127, engine.sample_rate, zone.source.open(), step, quality=quality)
+                        while not voice.finished:
+                            voice.render(engine, DEFAULT_PARAMS, 1024)
+                add(f"sample_voice/{seconds:g}s/{count} notes/{quality}", render_keymap, frames, count)
+    return results
+
+
+def measure_memory(func, output_bytes):
+    # tracemalloc widzi bufory NumPy; pierwsze wywolanie rozgrzewa bufory robocze i cache,
+    # mierzymy szczyt pamieci tymczasowej drugiego wywolania wzgledem rozmiaru wyniku
+    func()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        blocks = len(tracemalloc.take_snapshot().traces)
+        tracemalloc.reset_peak()
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+        retained = len(tracemalloc.take_snapshot().traces) - blocks
+    finally:
+        tracemalloc.stop()
+    del result
+    return {'peak_kb': (peak - before) / 1024, 'retained_kb': (current - before) / 1024,
+            'retained_blocks': retained, 'peak_x_output': (peak - before) / output_bytes}
+
+
+def run_memory_report(quick=False):
+    engine = SynthEngine()
+    samples = len(engine.t)
+    report = {}
+
+    def add(name, func, output_bytes):
+        stat = measure_memory(func, output_bytes)
+        report[name] = stat
+        print(f"{name:32s} peak {stat['peak_kb']:10.1f} KB  ({stat['peak_x_output']:5.1f}x output)  "
+              f"retained {stat['retained_kb']:8.1f} KB in {stat['retained_blocks']} blocks")
+
+    for effect in ('base', 'all') if quick else BENCH_EFFECTS:
+        params = dict(DEFAULT_PARAMS, **BENCH_EFFECTS[effect])
+        add(f"generate_wave/{effect}", lambda: engine.generate_wave(params), samples * 4)
+    add("apply_adsr", lambda: engine.apply_adsr(DEFAULT_PARAMS), samples * 4)
+    wave = engine.generate_wave(DEFAULT_PARAMS)
+    add("mono_to_int16_stereo", lambda: mono_to_int16_stereo(wave), samples * 4)
+
+    block_engine = StreamingEngine(engine, lambda: DEFAULT_PARAMS)
+    for note in range(60, 68):
+        block_engine.note_on(note, 100)
+    add("stream/8 voices x 1 block", lambda: block_engine.render(256), 256 * 8)
+
+    notes = list(range(54, 66))
+
+    def render_preset():
+        for chunk, waves in engine.render_notes(DEFAULT_PARAMS, notes):
+            for wave in waves:
+                mono_to_int16_stereo(wave)
+    add("process_preset/12 notes/base", render_preset, samples * 4 * len(notes))
+    return report
+
+
+def compare_benchmarks(results, baseline, tolerance=0.25):
+    regressions = []
+    for name, stat in results.items():
+        if name in baseline:
+            before = baseline[name]['median_ms']
+            if stat['median_ms'] > before * (1 + tolerance):
+                regressions.append((name, before, stat['median_ms']))
+    return regressions
+
+
+def bench_main(args):
+    results = run_benchmarks(quick=args.quick)
+    memory = run_memory_report(quick=args.quick) if args.memory else None
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'engine_version': ENGINE_VERSION, 'results': results, 'memory': memory}, f, indent=4)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            saved = json.load(f)
+        baseline = saved['results']
+        for name, stat in (memory or {}).items():
+            before = (saved.get('memory') or {}).get(name)
+            if before:
+                print(f"memory {name}: peak {before['peak_kb']:.1f} KB -> {stat['peak_kb']:.1f} KB")
+        regressions = compare_benchmarks(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: {before:.2f} ms -> {after:.2f} ms (+{(after / before - 1) * 100:.0f}%)")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance * 100:.0f}% against {args.compare}")
+
+
+def run_load_test(args):
+    # Silnik strumieniowy bez GUI i bez karty: --voices trzymanych nut przez wybrany wylot, bez pauz
+    # miedzy blokami, wiec czasy sa powtarzalne (np. w CI na serwerze bez dzwieku)
+    params = dict(DEFAULT_PARAMS, **BENCH_EFFECTS['all'])
+    if args.preset:
+        store = PresetStore()
+        store.scan()
+        params = dict(DEFAULT_PARAMS, **store[args.preset])
+    engine = StreamingEngine(SynthEngine(args.rate), lambda: params, args.block)
+    engine.pool.max_voices = args.voices
+    backend = 'null' if args.audio == 'pygame' else args.audio
+    output = open_output(backend, engine, args.block, args.format, args.audio_file, realtime=False)
+    for i in range(args.voices):
+        engine.note_on(48 + i % 36, 100)
+    # Pierwszy blok (import scipy.signal, bufory robocze) poza pomiarem
+    engine.render(args.block)
+    start = time.perf_counter()
+    output.run_for(args.load_test)
+    elapsed = time.perf_counter() - start
+    output.close()
+    seconds = output.frames_out / args.rate
+    print(output.stats_text())
+    print(f"{args.voices} voices, {seconds:.1f} s of audio in {elapsed:.2f} s ({seconds / elapsed:.1f}x real time)")
+
+
+def feature_main(args):
+    store = PresetStore(args.index_features)
+    store.scan()
+    start = time.perf_counter()
+    index = FeatureIndex(args.index_features)
+    changed, kept = index.update(store)
+    if args.random_patches:
+        seed = len(index.patches)
+        rng = random.Random(seed)
+        index.add_patches({f"random_{seed + i:05d}": random_patch(rng) for i in range(args.random_patches)})
+    if changed or args.random_patches:
+        index.save()
+    elapsed = time.perf_counter() - start
+    print(f"Feature index: {len(index)} patches ({changed} presets analyzed, {kept} up to date, "
+          f"{args.random_patches} random) in {elapsed:.2f} s")
+    if args.similar:
+        if args.similar not in index:
+            print(f"{args.similar} is not in the index")
+            sys.exit(1)
+        index.tree()
+        start = time.perf_counter()
+        results = index.nearest(index.features[index.names.index(args.similar)], args.neighbours, args.similar)
+        elapsed = time.perf_counter() - start
+        for name, distance in results:
+            print(f"{distance:8.4f}  {name}")
+        print(f"Search took {elapsed * 1000:.2f} ms")
+
+
+# Render biblioteki presetow z linii polecen, bez QApplication
+def _render_preset_notes(name, params, notes, out_dir, sample_rate, duration):
+    engine = _worker_state.get('engine')
+    if engine is None or (engine.sample_rate, engine.duration) != (sample_rate, duration):
+        engine = _worker_state['engine'] = SynthEngine(sample_rate, duration)
+    written = []
+    for chunk, waves in engine.render_notes(params, notes):
+        for note, wave in zip(chunk, waves):
+            filename = os.path.join(name, f"{name}_{note:03d}.wav")
+            wavfile.write(os.path.join(out_dir, filename), sample_rate, mono_to_int16_stereo(wave))
+            written.append((note, filename))
+    return name, written
+
+
+def parse_note_range(text):
+    low, _, high = text.partition('-')
+    low = int(low)
+    high = int(high) if high else low
+    if not 0 <= low <= high <= 127:
+        raise argparse.ArgumentTypeError(f"invalid note range: {text}")
+    return low, high
+
+
+def write_sfz(path, entries):
+    with open(path, 'w') as f:
+        f.write("// generated by synth_and_play.py\n<group>\n")
+        for entry in sorted(entries, key=lambda entry: entry['note']):
+            note = entry['note']
+            f.write(f"<region> sample={entry['file']} lokey={note} hikey={note} pitch_keycenter={note}\n")
+
+
+def render_library(preset_dir, out_dir, note_range, workers=None, sample_rate=44100, duration=2.0,
+                   chunk_notes=16, tag=None):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    store = PresetStore(preset_dir)
+    store.scan()
+    # tag filtruje po tagach z .index.json, bez czytania tresci pozostalych presetow
+    presets = {name: store[name] for name in store.names(tag)}
+
+    # Zadania tylko dla nut, ktorych plik nie istnieje albo powstal z innych params
+    jobs = []
+    skipped = 0
+    keys = {}
+    # Liczniki per preset: linia postepu dotyczy jednego presetu, sumy sa raz na koncu
+    preset_skipped = {}
+    preset_pending = {}
+    for name, params in presets.items():
+        os.makedirs(os.path.join(out_dir, name), exist_ok=True)
+        stale = []
+        for note in range(note_range[0], note_range[1] + 1):
+            filename = os.path.join(name, f"{name}_{note:03d}.wav")
+            key = render_key(params, note_to_freq(note), sample_rate, duration)
+            keys[filename] = key
+            entry = manifest.get(filename)
+            if entry and entry.get('key') == key and os.path.exists(os.path.join(out_dir, filename)):
+                skipped += 1
+                preset_skipped[name] = preset_skipped.get(name, 0) + 1
+            else:
+                stale.append(note)
+        preset_pending[name] = len(stale)
+        if not stale:
+            print(f"{name}: 0 rendered, {preset_skipped.get(name, 0)} up to date")
+        for start in range(0, len(stale), chunk_notes):
+            jobs.append((name, params, stale[start:start + chunk_notes]))
+
+    start_time = time.perf_counter()
+    rendered = 0
+    preset_rendered = {}
+    if jobs:
+        with ProcessPoolExecutor(workers or os.cpu_count() or 1) as pool:
+            futures = [pool.submit(_render_preset_notes, name, params, notes, out_dir, sample_rate, duration)
+                       for name, params, notes in jobs]
+            for future in as_completed(futures):
+                name, written = future.result()
+                for note, filename in written:
+                    manifest[filename] = {'preset': name, 'note': note, 'key': keys[filename],
+                                          'sample_rate': sample_rate, 'duration': duration}
+                    rendered += 1
+                preset_rendered[name] = preset_rendered.get(name, 0) + len(written)
+                preset_pending[name] -= len(written)
+                # Linia po ostatnim kawalku presetu, z jego wlasnymi licznikami
+                if preset_pending[name] == 0:
+                    print(f"{name}: {preset_rendered[name]} rendered, {preset_skipped.get(name, 0)} up to date")
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    for name in presets:
+        entries = [dict(entry, file=filename.replace(os.sep, '/')) for filename, entry in manifest.items()
+                   if entry['preset'] == name]
+        write_sfz(os.path.join(out_dir, f"{name}.sfz"), entries)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Rendered {rendered} notes, skipped {skipped} up-to-date, {len(presets)} presets in {elapsed:.2f} s")
+    return rendered, skipped
+
+
+# Bounce pliku MIDI (Standard MIDI File) do WAV przez StreamingEngine, szybciej niz w czasie rzeczywistym
+class MidiFile:
+    # Parser SMF formatu 0/1: zdarzenia nut z kazdej sciezki i mapa tempa przeliczajaca ticki na sekundy
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:4] != b'MThd':
+            raise ValueError("not a Standard MIDI File")
+        length, self.format, count, division = struct.unpack('>IHHh', data[4:14])
+        self.tracks = []
+        self.tempos = []
+        pos = 8 + length
+        while pos + 8 <= len(data) and len(self.tracks) < count:
+            chunk_id, size = struct.unpack('>4sI', data[pos:pos + 8])
+            if chunk_id == b'MTrk':
+                self.tracks.append(self._parse_track(data[pos + 8:pos + 8 + size], len(self.tracks)))
+            pos += 8 + size
+        if division < 0:
+            # SMPTE: klatki na sekunde * ticki na klatke, bez zaleznosci od tempa
+            self.seconds_per_tick = 1.0 / (-(division >> 8) * (division & 0xFF))
+            self.tempos = []
+        else:
+            self.seconds_per_tick = None
+            self.ticks_per_beat = division
+        self.tempos.sort()
+
+    @staticmethod
+    def _varlen(data, pos):
+        value = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            value = (value << 7) | (byte & 0x7F)
+            if not byte & 0x80:
+                return value, pos
+
+    def _parse_track(self, data, track):
+        events = []
+        pos = 0
+        tick = 0
+        status = 0
+        while pos < len(data):
+            delta, pos = self._varlen(data, pos)
+            tick += delta
+            if data[pos] & 0x80:
+                status = data[pos]
+                pos += 1
+            if status == 0xFF:
+                kind = data[pos]
+                length, pos = self._varlen(data, pos + 1)
+                if kind == 0x51:
+                    self.tempos.append((tick, int.from_bytes(data[pos:pos + 3], 'big')))
+                elif kind == 0x2F:
+                    break
+                pos += length
+            elif status in (0xF0, 0xF7):
+                length, pos = self._varlen(data, pos)
+                pos += length
+            else:
+                # running status: bajt statusu powtarzany z poprzedniego zdarzenia
+                kind, channel = status & 0xF0, status & 0x0F
+                size = 1 if kind in (0xC0, 0xD0) else 2
+                args = data[pos:pos + size]
+                pos += size
+                if kind == 0x90 and args[1] > 0:
+                    events.append((tick, True, args[0], args[1], channel))
+                elif kind == 0x80 or kind == 0x90:
+                    events.append((tick, False, args[0], 0, channel))
+        return events
+
+    def seconds(self, ticks):
+        # Ticki (tablica) na sekundy wg mapy tempa; domyslnie 120 BPM
+        ticks = np.asarray(ticks, dtype=np.float64)
+        if self.seconds_per_tick is not None:
+            return ticks * self.seconds_per_tick
+        starts = [0]
+        tempos = [500000]
+        for tick, tempo in self.tempos:
+            if tick == starts[-1]:
+                tempos[-1] = tempo
+            else:
+                starts.append(tick)
+                tempos.append(tempo)
+        starts = np.array(starts, dtype=np.float64)
+        rates = np.array(tempos, dtype=np.float64) / 1e6 / self.ticks_per_beat
+        offsets = np.concatenate([[0.0], np.cumsum(np.diff(starts) * rates[:-1])])
+        segment = np.searchsorted(starts, ticks, side='right') - 1
+        return offsets[segment] + (ticks - starts[segment]) * rates[segment]
+
+    def parts(self, sample_rate):
+        # Niezalezne partie (sciezka, kanal) jako listy (ramka, on, nuta, velocity); note off przed
+        # note on w tej samej ramce, zeby powtorzona nuta nie zostala od razu zwolniona
+        parts = {}
+        for track, events in enumerate(self.tracks):
+            if not events:
+                continue
+            frames = np.rint(self.seconds([event[0] for event in events]) * sample_rate).astype(np.int64)
+            for frame, (_, on, note, velocity, channel) in zip(frames.tolist(), events):
+                parts.setdefault((track, channel), []).append((frame, on, note, velocity))
+        return [sorted(events, key=lambda event: (event[0], event[1])) for _, events in sorted(parts.items())]
+
+
+def render_part(events, params, sample_rate, path, block_size=1024, tail=10.0, max_voices=64, make_voice=None,
+                chunk_frames=65536):
+    # Jedna partia przez StreamingEngine do surowego pliku float32 stereo; zdarzenia trafiaja
+    # z dokladnoscia do ramki (blok jest skracany do nastepnego zdarzenia)
+    engine = StreamingEngine(SynthEngine(sample_rate), lambda: params, block_size)
+    engine.pool.max_voices = max_voices
+    # Partia bez obcinania: szczyty ponad 1 zostaja do normalizacji miksu w bounce_midi
+    engine.clip = False
+    chunk = np.empty((chunk_frames, 2), np.float32)
+    fill = 0
+    position = 0
+    pending = 0
+    end = (events[-1][0] if events else 0) + int(tail * sample_rate)
+    with open(path, 'wb') as f:
+        while pending < len(events) or (engine.pool.voices and position < end):
+            while pending < len(events) and events[pending][0] <= position:
+                _, on, note, velocity = events[pending]
+                if on:
+                    engine.note_on(note, velocity, None, make_voice)
+                else:
+                    engine.note_off(note)
+                pending += 1
+            frames = min(block_size, chunk_frames - fill)
+            if pending < len(events):
+                frames = min(frames, max(1, events[pending][0] - position))
+            chunk[fill:fill + frames] = engine.render(frames)
+            fill += frames
+            position += frames
+            if fill == chunk_frames:
+                chunk.tofile(f)
+                fill = 0
+        chunk[:fill].tofile(f)
+    return position
+
+
+def _render_part_file(events, params, sample_rate, path):
+    return render_part(events, params, sample_rate, path)
+
+
+def prerender_keymap(keymap, played, workers=None, quality='high'):
+    # Transpozycje do bounce liczone z gory polifazowym resamplerem w puli procesow, po jednym
+    # buforze na uzyta nute strefy z pamieci; strefy strumieniowane z dysku zostaja przy odczycie
+    # przez SampleVoice. Wynik: {(strefa, nuta): MemorySample}
+    notes = {}
+    for note, velocity in played:
+        zone = keymap.find(note, velocity)
+        if zone is not None and isinstance(zone.source, MemorySample):
+            notes.setdefault(zone, set()).add(note)
+    rendered = {}
+    # spawn: jak przy partiach syntezy, bounce bywa wolany z GUI
+    pool = SampleRenderPool(workers, quality, 'float32', get_context('spawn'))
+    for zone, zone_notes in notes.items():
+        def keep(note, view, zone=zone):
+            rendered[(zone, note)] = MemorySample(view.copy(), zone.source.rate)
+        pool.render(zone.source.data, {note: note - zone.root for note in zone_notes}, keep)
+    return rendered
+
+
+def bounce_midi(midi_path, out_path, params, sample_rate=44100, workers=None, keymap=None, chunk_frames=65536):
+    # Partie renderowane rownolegle w procesach do plikow tymczasowych, potem miksowane kawalkami
+    # do WAV; w pamieci jest najwyzej chunk_frames ramek na partie. Probki z keymapy nie przechodza
+    # do innych procesow, wiec wtedy partie ida po kolei w tym procesie
+    start = time.perf_counter()
+    parts = MidiFile(midi_path).parts(sample_rate)
+    temp_dir = out_path + ".parts"
+    os.makedirs(temp_dir, exist_ok=True)
+    paths = [os.path.join(temp_dir, f"part_{i:03d}.f32") for i in range(len(parts))]
+    try:
+        if keymap is not None:
+            played = {(note, velocity) for events in parts for _, on, note, velocity in events if on}
+            rendered = prerender_keymap(keymap, played, workers)
+
+            def make_voice(note, velocity):
+                zone = keymap.find(note, velocity)
+                if zone is None:
+                    return None
+                source = rendered.get((zone, note))
+                if source is not None:
+                    cursor, step = source.open(), source.rate / sample_rate
+                else:
+                    cursor, step = zone.source.open(prefetch=False), zone.step(note, sample_rate)
+                # Krok 1 (nuta juz transponowana, ta sama czestotliwosc) to czysta kopia probek
+                return SampleVoice(note, velocity, sample_rate, cursor, step, params.get('release_time', 0.3),
+                                   'draft' if step == 1.0 else 'high')
+            lengths = [render_part(events, params, sample_rate, path, make_voice=make_voice)
+                       for events, path in zip(parts, paths)]
+        else:
+            # spawn: bounce bywa wolany z GUI, a fork procesu z watkami Qt/audio moze sie zakleszczyc
+            with ProcessPoolExecutor(workers or os.cpu_count() or 1, mp_context=get_context('spawn')) as pool:
+                lengths = list(pool.map(_render_part_file, parts, [params] * len(parts),
+                                        [sample_rate] * len(parts), paths))
+
+        total = max(lengths, default=0)
+        stems = [np.memmap(path, dtype=np.float32, mode='r', shape=(length, 2)) if length else None
+                 for path, length in zip(paths, lengths)]
+        mix = np.empty((chunk_frames, 2), np.float32)
+
+        def mixed_blocks():
+            for offset in range(0, total, chunk_frames):
+                block = mix[:min(chunk_frames, total - offset)]
+                block.fill(0)
+                for stem in stems:
+                    if stem is not None and offset < len(stem):
+                        part = stem[offset:offset + len(block)]
+                        block[:len(part)] += part
+                yield block
+
+        # Pierwsze przejscie: szczyt sumy partii; miks ponad pelna skale sciszamy do niego zamiast
+        # obcinac kazda partie i sume osobno
+        peak = max((float(np.abs(block).max()) for block in mixed_blocks()), default=0.0)
+        scale = 1.0 / peak if peak > 1.0 else 1.0
+        with WavWriter(out_path, sample_rate) as writer:
+            for block in mixed_blocks():
+                if scale != 1.0:
+                    block *= scale
+                # Jedyne obciecie, tuz przed zapisem int16
+                np.clip(block, -1, 1, out=block)
+                writer.write(block)
+        del stems
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(temp_dir)
+
+    elapsed = time.perf_counter() - start
+    seconds = total / sample_rate
+    return seconds, elapsed, len(parts)
+
 
 class WavInstrumentApp(QMainWindow):
-    def __init__(self):
+    ui_fps = 30
+    black_keys = (1, 3, 6, 8, 10)
+    devices_ready = pyqtSignal(object)
+    similar_ready = pyqtSignal(object)
+    presets_scanned = pyqtSignal(object)
+    bounce_ready = pyqtSignal(object)
+
+    def __init__(self, exit_after_startup=False, audio=None):
         super().__init__()
         self.setWindowTitle("WAV MIDI Instrument with Wave Generator")
         self.setMinimumSize(800, 400)
+        self.exit_after_startup = exit_after_startup
+        self.devices_ready.connect(self.on_devices_ready)
+        self.similar_ready.connect(self.show_similar)
+        self.presets_scanned.connect(self.apply_preset_scan)
+        self.preset_scan_busy = False
+        self.bounce_ready.connect(self.show_bounce_result)
+        self.feature_index = None
+        self.similar_busy = False
 
-        pygame.mixer.pre_init(44100, -16, 2, 512)
-        pygame.mixer.init()
-        pygame.mixer.set_num_channels(128)
-        
-        self.sample_rate = 44100
-        self.duration = 2.0
-        self.t = np.linspace(0, self.duration, int(self.sample_rate * self.duration))
+        engine_start = time.perf_counter()
+        self.audio_config = dict(AUDIO_DEFAULTS, **(audio or {}))
+        self.engine = SynthEngine(self.audio_config['rate'], 2.0)
+        self.sample_rate = self.engine.sample_rate
+        # Bufor miksera dla trybu pre-renderowanego: dwa bloki strumienia (512 ramek domyslnie)
+        self.mixer_buffer = 2 * self.audio_config['block']
+        self.duration = self.engine.duration
+        self.t = self.engine.t
         
-        self.base_sample = None
-        self.processed_sounds = {}
-        self.active_notes = {}
+        self.keymap = Keymap()
+        self.sample_keymap = None
+        self.stream_sample_seconds = 30.0
+        self.render_cache = RenderCache()
+        self.sound_store = SoundStore()
+        self.channel_pool = VoicePool(64)
         
-        self.wave_shapes = {
-            'sine': lambda t, freq: np.sin(2 * np.pi * freq * t),
-            'square': lambda t, freq: signal.square(2 * np.pi * freq * t),
-            'sawtooth': lambda t, freq: signal.sawtooth(2 * np.pi * freq * t),
-            'triangle': lambda t, freq: signal.sawtooth(2 * np.pi * freq * t, 0.5),
-            'noise': lambda t, freq: np.random.normal(0, 1, len(t)),
-            'custom': self.custom_wave  # Nowa, uproszczona wersja
-        }
+        self.wave_shapes = self.engine.wave_shapes
+        STARTUP.add("engine and stores", engine_start)
         
-        self.params = {
-            'wave_shape1': 'sine', 'wave_shape2': 'sine', 'wave_mix': 0.5, 'frequency': 440.0,
-            'freq_mod': 0.0, 'freq_mod_rate': 0.0, 'amp_mod': 0.0, 'amp_mod_rate': 0.0,
-            'harm1_weight': 1.0, 'harm2_weight': 0.5, 'harm3_weight': 0.25, 'harm4_weight': 0.125, 'harm5_weight': 0.0625,
-            'attack_time': 0.1, 'decay_time': 0.2, 'sustain_level': 0.7, 'release_time': 0.3,
-            'vibrato_rate': 0.0, 'vibrato_depth': 0.0, 'tremolo_rate': 0.0, 'tremolo_depth': 0.0,
-            'distortion': 0.0, 'noise_level': 0.0, 'bit_crush': 0.0, 'fold_amount': 0.0,
-            'filter_cutoff': 20000, 'filter_resonance': 0.0, 'chorus_depth': 0.0, 'chorus_rate': 0.0
-        }
+        self.params = dict(DEFAULT_PARAMS)
         
-        self.presets = {}
+        self.presets = PresetStore()
+        self.preset_model = QStringListModel()
         self.current_preset_name = ""
         self.sound = None
         self.is_looping = False
@@ -61,6 +3115,26 @@ class WavInstrumentApp(QMainWindow):
         self.updating_waveform = False
         self.background_timer = QTimer()
 
+        self.preview_renderer = PreviewRenderer(self.engine)
+        self.preview_renderer.ready.connect(self.draw_waveform)
+        self.preview_timer = QTimer()
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(30)
+        self.preview_timer.timeout.connect(lambda: self.preview_renderer.submit(self.params))
+
+        self.stream_engine = StreamingEngine(self.engine, lambda: self.params, self.audio_config['block'])
+        self.streaming = True
+        self.master_volume = 0.8
+        self.telemetry = UiTelemetry()
+        self.midi_ring = MidiRing()
+        self.latency = LatencyTracer()
+        self.stream_engine.tracer = self.latency
+        self.midi_dispatcher = MidiDispatcher(self.midi_ring, self.play_note, self.stop_note, tracer=self.latency)
+        self.midi_dispatcher.start()
+        self.audio_device = None
+        self.pending_preview_key = None
+
+        gui_start = time.perf_counter()
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
         main_layout = QVBoxLayout(central_widget)
@@ -85,8 +3159,68 @@ class WavInstrumentApp(QMainWindow):
         self.tabs.addTab(self.wave_tab, "Wave Generator")
 
         self.midi_in = None
-        self.get_available_midi_ports()
-        self.load_presets_from_directory()
+        STARTUP.add("build widgets", gui_start)
+        with STARTUP.phase("preset index scan"):
+            self.load_presets_from_directory()
+        with STARTUP.phase("initial preview"):
+            self.show_cached_preview()
+        self.start_devices()
+
+        # Katalog presetow sprawdzany co 2 s: stat kazdego pliku w watku w tle, na watku GUI tylko
+        # porownanie z indeksem i odczyt zmienionych plikow
+        self.preset_scan_timer = QTimer()
+        self.preset_scan_timer.timeout.connect(self.scan_presets_in_background)
+        self.preset_scan_timer.start(2000)
+
+    def start_devices(self):
+        # Mikser, strumien audio, porty MIDI i import scipy w watku w tle, gdy okno juz sie rysuje
+        threading.Thread(target=self.probe_devices, name="startup", daemon=True).start()
+
+    def probe_devices(self):
+        with STARTUP.phase("mixer init"):
+            if self.audio_config['backend'] != 'pygame':
+                # Bez karty dzwiekowej: mikser na sterowniku dummy, zeby tryb Sound/Channel dalej dzialal
+                os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+            pygame.mixer.pre_init(self.sample_rate, -16, 2, self.mixer_buffer)
+            pygame.mixer.init()
+            pygame.mixer.set_num_channels(128)
+        with STARTUP.phase("audio stream"):
+            self.start_stream()
+        try:
+            with STARTUP.phase("midi port probe"):
+                ports = rtmidi.MidiIn().get_ports()
+        except Exception as e:
+            ports = e
+        signal.load()
+        self.devices_ready.emit(ports)
+
+    def on_devices_ready(self, ports):
+        self.show_midi_ports(ports)
+        if self.exit_after_startup:
+            STARTUP.add("devices ready", STARTUP.origin)
+            print(STARTUP.text())
+            QApplication.quit()
+
+    def show_cached_preview(self):
+        # Pierwszy podglad z cache renderow; przy braku zapisujemy go, gdy przyjdzie z watku podgladu
+        key = self.preview_key()
+        samples = self.render_cache.get(key)
+        if samples is None:
+            self.pending_preview_key = key
+            return
+        self.preview_timer.stop()
+        # Cache trzyma mono int16 (wspolne z renderami nut, np. dla widoku calej nuty)
+        samples = np.asarray(samples, dtype=np.float32) / 32767
+        # rysujemy po pierwszym przebiegu petli zdarzen, gdy widok ma juz docelowa szerokosc
+        QTimer.singleShot(0, lambda: self.draw_waveform(samples))
+
+    def preview_key(self):
+        # length=None (widok calej nuty) to pelny bufor silnika
+        length = self.preview_renderer.length
+        if length is None:
+            length = len(self.t)
+        return self.render_cache.key(self.params, self.params.get('frequency', 440.0), self.sample_rate,
+                                     length / self.sample_rate)
 
     def setup_main_gui(self, layout):
         pianoroll_group = QGroupBox("Pianoroll")
@@ -105,6 +3239,11 @@ class WavInstrumentApp(QMainWindow):
         self.pianoroll_view.setScene(self.pianoroll_scene)
         self.pianoroll_view.setMinimumHeight(100)
         self.pianoroll_scene.mousePressEvent = self.pianoroll_mouse_press
+        self.pianoroll_scene.mouseReleaseEvent = self.pianoroll_mouse_release
+        self.pianoroll_note = None
+        self.pianoroll_keys = {}
+        self.pianoroll_geometry = (0, 0, 1.0, 100)
+        self.shown_keys = np.zeros(128, dtype=bool)
         pianoroll_layout.addWidget(self.pianoroll_view)
         pianoroll_group.setLayout(pianoroll_layout)
         layout.addWidget(pianoroll_group)
@@ -114,6 +3253,7 @@ class WavInstrumentApp(QMainWindow):
         preset_layout = QVBoxLayout()
         
         self.main_preset_combo = QComboBox()
+        self.main_preset_combo.setModel(self.preset_model)
         self.main_preset_combo.currentTextChanged.connect(self.load_main_preset)
         preset_layout.addWidget(self.main_preset_combo)
         
@@ -124,6 +3264,10 @@ class WavInstrumentApp(QMainWindow):
         self.save_preset_wav_button = QPushButton("Save Preset to WAV")
         self.save_preset_wav_button.clicked.connect(self.save_preset_to_wav)
         preset_layout.addWidget(self.save_preset_wav_button)
+
+        self.bounce_button = QPushButton("Bounce MIDI File to WAV")
+        self.bounce_button.clicked.connect(self.bounce_midi_file)
+        preset_layout.addWidget(self.bounce_button)
         
         preset_group.setLayout(preset_layout)
         layout.addWidget(preset_group)
@@ -138,6 +3282,14 @@ class WavInstrumentApp(QMainWindow):
         self.volume_slider.valueChanged.connect(self.update_volume)
         volume_layout.addWidget(QLabel("Master Volume:"))
         volume_layout.addWidget(self.volume_slider)
+
+        self.playback_mode = QComboBox()
+        self.playback_mode.addItem("Streaming synth (live params)", 'stream')
+        self.playback_mode.addItem("Pre-rendered sounds", 'sounds')
+        self.playback_mode.addItem("Sample keymap", 'keymap')
+        self.playback_mode.currentIndexChanged.connect(self.update_playback_mode)
+        volume_layout.addWidget(QLabel("Playback:"))
+        volume_layout.addWidget(self.playback_mode)
         
         volume_group.setLayout(volume_layout)
         layout.addWidget(volume_group)
@@ -156,13 +3308,38 @@ class WavInstrumentApp(QMainWindow):
         
         self.sample_debug = QLabel("Sample status: No sample loaded")
         debug_layout.addWidget(self.sample_debug)
+
+        self.underrun_debug = QLabel("Disk stream underruns: 0")
+        debug_layout.addWidget(self.underrun_debug)
         
         self.note_debug = QLabel("Last MIDI event: None")
         debug_layout.addWidget(self.note_debug)
+
+        self.cache_debug = QLabel(self.render_cache.stats_text())
+        debug_layout.addWidget(self.cache_debug)
+
+        self.sound_debug = QLabel(self.sound_store.stats_text())
+        debug_layout.addWidget(self.sound_debug)
+
+        self.sound_budget = QSpinBox()
+        self.sound_budget.setRange(8, 4096)
+        self.sound_budget.setValue(self.sound_store.budget // (1024 * 1024))
+        self.sound_budget.setPrefix("Sound Memory Budget: ")
+        self.sound_budget.setSuffix(" MB")
+        self.sound_budget.valueChanged.connect(self.sound_store.set_budget)
+        debug_layout.addWidget(self.sound_budget)
         
         debug_group.setLayout(debug_layout)
         layout.addWidget(debug_group)
 
+        # Etykiety i pianoroll odswiezane w stalym rytmie klatek, niezaleznie od liczby zdarzen MIDI
+        self.shown_ui_state = None
+        self.shown_cache_state = None
+        self.shown_underruns = 0
+        self.ui_timer = QTimer()
+        self.ui_timer.timeout.connect(self.refresh_ui)
+        self.ui_timer.start(1000 // self.ui_fps)
+
         port_group = QGroupBox("MIDI Settings")
         port_layout = QVBoxLayout()
         
@@ -181,17 +3358,62 @@ class WavInstrumentApp(QMainWindow):
         port_group.setLayout(port_layout)
         layout.addWidget(port_group)
 
+        voice_group = QGroupBox("Voices")
+        voice_layout = QHBoxLayout()
+
+        self.max_polyphony = QSpinBox()
+        self.max_polyphony.setRange(1, 120)
+        self.max_polyphony.setValue(32)
+        self.max_polyphony.setPrefix("Max Polyphony: ")
+        self.max_polyphony.valueChanged.connect(self.update_voice_settings)
+        voice_layout.addWidget(self.max_polyphony)
+
+        self.steal_policy = QComboBox()
+        self.steal_policy.addItems(VoicePool.policies)
+        self.steal_policy.currentTextChanged.connect(self.update_voice_settings)
+        voice_layout.addWidget(self.steal_policy)
+
+        self.voice_debug = QLabel()
+        voice_layout.addWidget(self.voice_debug)
+
+        voice_group.setLayout(voice_layout)
+        layout.addWidget(voice_group)
+        self.update_voice_settings()
+
+        latency_group = QGroupBox("MIDI-to-Audio Latency")
+        latency_layout = QVBoxLayout()
+        self.latency_debug = QLabel(self.latency.summary_text())
+        latency_layout.addWidget(self.latency_debug)
+        self.audio_debug = QLabel("Audio output: starting")
+        self.audio_debug.setWordWrap(True)
+        latency_layout.addWidget(self.audio_debug)
+        latency_buttons = QHBoxLayout()
+        export_latency_button = QPushButton("Export Latency JSON")
+        export_latency_button.clicked.connect(self.export_latency)
+        latency_buttons.addWidget(export_latency_button)
+        reset_latency_button = QPushButton("Reset")
+        reset_latency_button.clicked.connect(self.latency.reset)
+        latency_buttons.addWidget(reset_latency_button)
+        latency_layout.addLayout(latency_buttons)
+        latency_group.setLayout(latency_layout)
+        layout.addWidget(latency_group)
+        self.latency_timer = QTimer()
+        self.latency_timer.timeout.connect(lambda: self.latency_debug.setText(self.latency.summary_text()))
+        self.latency_timer.timeout.connect(
+            lambda: self.audio_device and self.audio_debug.setText(self.audio_device.stats_text()))
+        self.latency_timer.start(500)
+
         sample_group = QGroupBox("Sample Settings")
         sample_layout = QVBoxLayout()
 
-        self.load_button = QPushButton("Load WAV Sample")
+        self.load_button = QPushButton("Load WAV Sample as Zone")
         self.load_button.clicked.connect(self.load_sample)
         sample_layout.addWidget(self.load_button)
 
         self.base_note = QSpinBox()
         self.base_note.setRange(0, 127)
         self.base_note.setValue(60)
-        self.base_note.setPrefix("Base Note (MIDI): ")
+        self.base_note.setPrefix("Root Note (MIDI): ")
         sample_layout.addWidget(self.base_note)
 
         range_layout = QHBoxLayout()
@@ -209,9 +3431,33 @@ class WavInstrumentApp(QMainWindow):
         
         sample_layout.addLayout(range_layout)
 
-        self.process_button = QPushButton("Process Sample")
+        velocity_layout = QHBoxLayout()
+        self.min_velocity = QSpinBox()
+        self.min_velocity.setRange(0, 127)
+        self.min_velocity.setValue(0)
+        self.min_velocity.setPrefix("Min Velocity: ")
+        velocity_layout.addWidget(self.min_velocity)
+
+        self.max_velocity = QSpinBox()
+        self.max_velocity.setRange(0, 127)
+        self.max_velocity.setValue(127)
+        self.max_velocity.setPrefix("Max Velocity: ")
+        velocity_layout.addWidget(self.max_velocity)
+
+        sample_layout.addLayout(velocity_layout)
+
+        self.keymap_label = QLabel("Keymap: no zones")
+        sample_layout.addWidget(self.keymap_label)
+
+        keymap_buttons = QHBoxLayout()
+        self.process_button = QPushButton("Play Sample Keymap")
         self.process_button.clicked.connect(self.process_sample)
-        sample_layout.addWidget(self.process_button)
+        keymap_buttons.addWidget(self.process_button)
+
+        clear_zones_button = QPushButton("Clear Zones")
+        clear_zones_button.clicked.connect(self.clear_zones)
+        keymap_buttons.addWidget(clear_zones_button)
+        sample_layout.addLayout(keymap_buttons)
 
         sample_group.setLayout(sample_layout)
         layout.addWidget(sample_group)
@@ -232,6 +3478,19 @@ class WavInstrumentApp(QMainWindow):
         self.wave_view.setMinimumHeight(150)
         layout.addWidget(self.wave_view)
 
+        # Elementy sceny tworzone raz i aktualizowane w miejscu
+        self.wave_axis = self.wave_scene.addLine(0, 75, 0, 75, QPen(Qt.GlobalColor.gray))
+        self.wave_origin = self.wave_scene.addLine(0, 0, 0, 150, QPen(Qt.GlobalColor.gray))
+        self.wave_path = self.wave_scene.addPath(QPainterPath(), QPen(Qt.GlobalColor.blue, 1))
+        self.play_line = self.wave_scene.addLine(0, 0, 0, 150, QPen(Qt.GlobalColor.red, 2))
+
+        self.scope_zoom = QComboBox()
+        self.scope_zoom.addItem("View: 2000 samples", 2000)
+        self.scope_zoom.addItem("View: 0.25 s", int(self.sample_rate * 0.25))
+        self.scope_zoom.addItem("View: full note", None)
+        self.scope_zoom.currentIndexChanged.connect(self.update_scope_zoom)
+        layout.addWidget(self.scope_zoom)
+
         control_widget = QWidget()
         control_layout = QHBoxLayout(control_widget)
         
@@ -248,7 +3507,7 @@ class WavInstrumentApp(QMainWindow):
             'Effects': ['vibrato_rate', 'vibrato_depth', 'tremolo_rate', 'tremolo_depth', 
                         'distortion', 'noise_level', 'bit_crush', 'fold_amount'],
             'Filter': ['filter_cutoff', 'filter_resonance'],
-            'Chorus': ['chorus_depth', 'chorus_rate']
+            'Chorus': ['chorus_depth', 'chorus_rate', 'chorus_mix']
         }
 
         for group_name, params in param_groups.items():
@@ -258,10 +3517,13 @@ class WavInstrumentApp(QMainWindow):
                 slider_layout = QHBoxLayout()
                 label = QLabel(param)
                 slider = QSlider(Qt.Orientation.Horizontal)
-                slider.setRange(0, 100 if any(x in param for x in ['weight', 'level', 'depth', 'mix', 'amount']) else 
-                                200 if 'time' in param else 2000 if 'freq' in param or 'rate' in param else 100)
-                slider.setValue(int(self.params[param] * (100 if any(x in param for x in ['weight', 'level', 'depth', 'mix', 'amount']) else 
-                                                        100 if 'time' in param else 1)))
+                # chorus_rate: LFO 0-20 Hz (Chorus.MAX_RATE) co 0.01 Hz
+                slider.setRange(0, 100 if any(x in param for x in ['weight', 'level', 'depth', 'mix', 'amount', 'resonance']) else 
+                                int(Chorus.MAX_RATE * 100) if param == 'chorus_rate' else
+                                200 if 'time' in param else 20000 if 'cutoff' in param else
+                                2000 if 'freq' in param or 'rate' in param else 100)
+                slider.setValue(int(self.params[param] * (100 if any(x in param for x in ['weight', 'level', 'depth', 'mix', 'amount', 'resonance']) else 
+                                                        100 if 'time' in param or param == 'chorus_rate' else 1)))
                 slider.valueChanged.connect(lambda val, p=param: self.update_param(p, val))
                 slider_layout.addWidget(label)
                 slider_layout.addWidget(slider)
@@ -296,9 +3558,16 @@ class WavInstrumentApp(QMainWindow):
         wave_group.setLayout(wave_layout)
         right_layout.addWidget(wave_group)
 
+        self.filter_mode_combo = QComboBox()
+        self.filter_mode_combo.addItems(FILTER_MODES)
+        self.filter_mode_combo.currentTextChanged.connect(self.update_filter_mode)
+        right_layout.addWidget(QLabel("Filter Mode:"))
+        right_layout.addWidget(self.filter_mode_combo)
+
         preset_group = QGroupBox("Presets")
         preset_layout = QVBoxLayout()
         self.preset_combo = QComboBox()
+        self.preset_combo.setModel(self.preset_model)
         self.preset_combo.currentTextChanged.connect(self.load_preset)
         preset_layout.addWidget(self.preset_combo)
         
@@ -312,6 +3581,20 @@ class WavInstrumentApp(QMainWindow):
         random_btn = QPushButton("Randomize")
         random_btn.clicked.connect(self.randomize_params)
         preset_layout.addWidget(random_btn)
+
+        similar_buttons = QHBoxLayout()
+        similar_btn = QPushButton("Find Similar")
+        similar_btn.clicked.connect(lambda: self.find_similar())
+        similar_buttons.addWidget(similar_btn)
+        random_batch_btn = QPushButton("Random Batch (256)")
+        random_batch_btn.clicked.connect(lambda: self.find_similar(random_patches=256))
+        similar_buttons.addWidget(random_batch_btn)
+        preset_layout.addLayout(similar_buttons)
+
+        self.similar_list = QListWidget()
+        self.similar_list.setMaximumHeight(120)
+        self.similar_list.itemDoubleClicked.connect(self.load_similar)
+        preset_layout.addWidget(self.similar_list)
         
         export_btn = QPushButton("Export Presets")
         export_btn.clicked.connect(self.export_presets)
@@ -341,7 +3624,8 @@ class WavInstrumentApp(QMainWindow):
 
     # Main Tab Methods
     def update_pianoroll(self, size=None):
-        self.pianoroll_scene.clear()
+        # Klawisze to trwale elementy sceny: zmiana rozmiaru tylko przesuwa prostokaty, a nowe
+        # elementy powstaja wylacznie przy zmianie zakresu klawiatury
         width = self.pianoroll_view.width()
         height = 100
         
@@ -357,24 +3641,68 @@ class WavInstrumentApp(QMainWindow):
             start_note = 36  # C2
         
         key_width = width / keys
-        
-        for i in range(keys):
-            note = start_note + i
-            is_black = note % 12 in [1, 3, 6, 8, 10]
-            x = i * key_width
-            rect = QRectF(x, 0, key_width, height * (0.6 if is_black else 1.0))
-            color = QColor(Qt.GlobalColor.black) if is_black else QColor(Qt.GlobalColor.white)
-            item = self.pianoroll_scene.addRect(rect, QPen(Qt.GlobalColor.gray), color)
-            item.setData(0, note)
+        notes = range(start_note, start_note + keys)
+        if set(self.pianoroll_keys) != set(notes):
+            for item in self.pianoroll_keys.values():
+                self.pianoroll_scene.removeItem(item)
+            self.pianoroll_keys = {note: self.pianoroll_scene.addRect(QRectF(), QPen(Qt.GlobalColor.gray))
+                                   for note in notes}
+            self.shown_keys[:] = False
+            for note in notes:
+                self.paint_key(note, self.telemetry.held[note])
+        for i, note in enumerate(notes):
+            is_black = note % 12 in self.black_keys
+            self.pianoroll_keys[note].setRect(QRectF(i * key_width, 0, key_width, height * (0.6 if is_black else 1.0)))
+        self.pianoroll_geometry = (start_note, keys, key_width, height)
         self.pianoroll_view.setSceneRect(0, 0, width, height)
 
+    def paint_key(self, note, active):
+        is_black = note % 12 in self.black_keys
+        color = QColor(70, 110, 220) if active else QColor(Qt.GlobalColor.black) if is_black else QColor(Qt.GlobalColor.white)
+        self.pianoroll_keys[note].setBrush(QBrush(color))
+        self.shown_keys[note] = active
+
+    def pianoroll_note_at(self, pos):
+        # Trafienie liczone z geometrii klawiatury zamiast itemAt na scenie
+        start_note, keys, key_width, height = self.pianoroll_geometry
+        i = int(pos.x() // key_width) if key_width > 0 else -1
+        if not 0 <= i < keys or not 0 <= pos.y() <= height:
+            return None
+        note = start_note + i
+        if note % 12 in self.black_keys and pos.y() > height * 0.6:
+            return None
+        return note
+
     def pianoroll_mouse_press(self, event):
-        item = self.pianoroll_scene.itemAt(event.scenePos(), self.pianoroll_view.transform())
-        if item:
-            note = item.data(0)
-            if note in self.processed_sounds:
+        note = self.pianoroll_note_at(event.scenePos())
+        if note is not None:
+            if self.is_streaming() or self.sound_store.source is not None or self.sample_keymap is not None:
                 self.play_note(note, 100)
-                self.debug_label.setText(f"Pianoroll: Played note {note}")
+                self.pianoroll_note = note
+
+    def pianoroll_mouse_release(self, event):
+        if self.pianoroll_note is not None:
+            if self.is_streaming() or self.sample_keymap is not None:
+                self.stop_note(self.pianoroll_note)
+            else:
+                # Gotowy Sound wybrzmiewa do konca; gasimy tylko klawisz
+                self.telemetry.note('stop', self.pianoroll_note)
+        self.pianoroll_note = None
+
+    def is_streaming(self):
+        return self.streaming
+
+    def update_playback_mode(self):
+        mode = self.playback_mode.currentData()
+        self.streaming = mode == 'stream'
+        if mode != 'keymap':
+            self.sample_keymap = None
+
+    def start_stream(self):
+        config = self.audio_config
+        self.audio_device = open_output(config['backend'], self.stream_engine, config['block'], config['format'],
+                                        config['path'])
+        self.audio_device.pause(0)
 
     def load_main_preset(self, name):
         if name in self.presets:
@@ -384,7 +3712,8 @@ class WavInstrumentApp(QMainWindow):
             self.params.setdefault('wave_shape2', 'sine')
             self.params.setdefault('frequency', 440.0)
             self.debug_label.setText(f"Loaded preset: {name}")
-            self.background_timer.singleShot(100, self.background_process_preset)
+            if not self.is_streaming():
+                self.background_timer.singleShot(100, self.background_process_preset)
 
     def background_process_preset(self):
         self.process_preset()
@@ -395,62 +3724,66 @@ class WavInstrumentApp(QMainWindow):
             self.debug_label.setText("Please select a preset first")
             return
 
-        try:
-            self.processed_sounds.clear()
-            base_freq = self.params.get('frequency', 440.0)
-            total_notes = self.max_note.value() - self.min_note.value() + 1
-            self.progress.setMaximum(total_notes)
-            self.progress.setValue(0)
-
-            for note in range(self.min_note.value(), self.max_note.value() + 1):
-                target_freq = 440 * (2 ** ((note - 69) / 12))
-                self.params['frequency'] = target_freq
-                wave = self.generate_wave()
-                wave_stereo = np.vstack((wave, wave)).T.astype(np.float32)
-                wave_int16 = np.int16(wave_stereo * 32767).copy(order='C')
-                
-                try:
-                    sound = pygame.mixer.Sound(wave_int16)
-                    self.processed_sounds[note] = sound
-                except Exception as e:
-                    self.debug_label.setText(f"Error creating sound for note {note}: {str(e)}")
-                    continue
+        # Nuty renderuja sie przy pierwszym zagraniu (z cache na dysku albo z silnika); MIDI gra
+        # to, co przetworzono, wiec przelaczamy sie z trybu strumieniowego na gotowe dzwieki
+        self.playback_mode.setCurrentIndex(self.playback_mode.findData('sounds'))
+        self.sample_keymap = None
+        params = dict(self.params)
+        low, high = self.min_note.value(), self.max_note.value()
 
-                self.progress.setValue(note - self.min_note.value() + 1)
-                QApplication.processEvents()
+        def render(note):
+            if not low <= note <= high:
+                return None
+            key = self.render_cache.key(params, note_to_freq(note), self.sample_rate, self.duration)
+            data = self.render_cache.get(key)
+            if data is None:
+                data = mono_to_int16(self.engine.generate_wave(params, note_to_freq(note)))
+                self.render_cache.put(key, data)
+            return data
 
-            self.debug_label.setText(f"Processed {len(self.processed_sounds)} notes from preset '{self.current_preset_name}'\n"
-                                     f"Range: {self.min_note.value()} to {self.max_note.value()}")
-            self.params['frequency'] = base_freq
-        except Exception as e:
-            self.debug_label.setText(f"Error processing preset: {str(e)}")
+        self.sound_store.reset(render)
+        self.sound_store.warm(60)
+        self.progress.setMaximum(high - low + 1)
+        self.debug_label.setText(f"Preset '{self.current_preset_name}' ready, notes render on demand\n"
+                                 f"Range: {low} to {high}")
 
     def save_preset_to_wav(self):
         if not self.current_preset_name or self.current_preset_name not in self.presets:
             self.debug_label.setText("Please select a preset first")
             return
-        wave = self.generate_wave()
-        wave_stereo = np.vstack((wave, wave)).T.astype(np.float32)
-        wave_int16 = np.int16(wave_stereo * 32767).copy(order='C')
+        freq = self.params.get('frequency', 440.0)
+        key = self.render_cache.key(self.params, freq, self.sample_rate, self.duration)
+        mono = self.render_cache.get(key)
+        if mono is None:
+            mono = mono_to_int16(self.generate_wave())
+            self.render_cache.put(key, mono)
+        self.cache_debug.setText(self.render_cache.stats_text())
         filename = f"preset_{self.current_preset_name}_{self.params.get('frequency', 440.0)}Hz.wav"
-        wavfile.write(filename, self.sample_rate, wave_int16)
+        wavfile.write(filename, self.sample_rate, mono_to_int16_stereo(mono))
         self.debug_label.setText(f"Saved preset to {filename}")
 
     # MIDI Methods
     def test_sound(self):
         note = 60
-        if note in self.processed_sounds:
-            sound = self.processed_sounds[note]
+        sound = self.note_sound(note)
+        if sound:
             sound.play()
             self.debug_label.setText(f"Playing test sound for note {note}")
         else:
             self.debug_label.setText(f"No processed sound for note {note}")
 
     def get_available_midi_ports(self):
+        try:
+            ports = rtmidi.MidiIn().get_ports()
+        except Exception as e:
+            ports = e
+        self.show_midi_ports(ports)
+
+    def show_midi_ports(self, ports):
         self.midi_port_selector.clear()
-        midi_in = rtmidi.MidiIn()
-        ports = midi_in.get_ports()
-        
+        if isinstance(ports, Exception):
+            self.midi_debug.setText(f"MIDI unavailable: {str(ports)}")
+            return
         if not ports:
             self.midi_debug.setText("No MIDI input ports found")
             return
@@ -478,191 +3811,192 @@ class WavInstrumentApp(QMainWindow):
         )
         if file_name:
             try:
-                sample_rate, audio_data = wavfile.read(file_name)
-                if len(audio_data.shape) > 1:
-                    audio_data = np.mean(audio_data, axis=1)
-
-                audio_data = audio_data.astype(np.float32)
-                audio_data /= np.max(np.abs(audio_data))
-
-                self.base_sample = {
-                    'path': file_name,
-                    'rate': sample_rate,
-                    'data': audio_data
-                }
-                
+                reader = WavReader(file_name)
+                if reader.duration > self.stream_sample_seconds:
+                    # Dluga probka zostaje na dysku; w pamieci tylko poczatek, reszta czytana w locie
+                    source = SampleStream(reader)
+                    mode = f"streamed from disk ({len(source.head)} head frames resident)"
+                else:
+                    source = MemorySample(reader.read_normalized(), reader.rate)
+                    mode = "loaded into memory"
+
+                self.add_zone(source, os.path.basename(file_name))
                 self.sample_debug.setText(f"Loaded sample: {os.path.basename(file_name)}\n"
-                                          f"Sample rate: {sample_rate}Hz\n"
-                                          f"Length: {len(audio_data)} samples")
+                                          f"Sample rate: {reader.rate}Hz, {reader.channels} ch, {reader.bits}-bit\n"
+                                          f"Length: {reader.frames} samples, {mode}")
             except Exception as e:
                 self.sample_debug.setText(f"Error loading sample: {str(e)}")
 
+    def add_zone(self, source, name):
+        self.keymap.add(SampleZone(source, self.base_note.value(), self.min_note.value(), self.max_note.value(),
+                                   self.min_velocity.value(), self.max_velocity.value(), name))
+        self.keymap_label.setText(f"Keymap ({len(self.keymap)} zones):\n{self.keymap.describe()}")
+
+    def clear_zones(self):
+        self.keymap.clear()
+        self.sample_keymap = None
+        self.keymap_label.setText("Keymap: no zones")
+
     def process_sample(self):
-        if not self.base_sample:
+        if not self.keymap:
             self.sample_debug.setText("Please load a sample first")
             return
 
-        try:
-            self.processed_sounds.clear()
-            base_freq = 440 * (2 ** ((self.base_note.value() - 69) / 12))
-            total_notes = self.max_note.value() - self.min_note.value() + 1
-            self.progress.setMaximum(total_notes)
-            self.progress.setValue(0)
-
-            for note in range(self.min_note.value(), self.max_note.value() + 1):
-                target_freq = 440 * (2 ** ((note - 69) / 12))
-                pitch_ratio = target_freq / base_freq
-                
-                original_length = len(self.base_sample['data'])
-                new_length = int(original_length / pitch_ratio)
-                
-                resampled = signal.resample(self.base_sample['data'], new_length)
-                audio_int16 = np.int16(resampled * 32767)
-                
-                try:
-                    sound = pygame.mixer.Sound(audio_int16)
-                    self.processed_sounds[note] = sound
-                except Exception as e:
-                    self.sample_debug.setText(f"Error creating sound for note {note}: {str(e)}")
-                    continue
-
-                self.progress.setValue(note - self.min_note.value() + 1)
-                QApplication.processEvents()
+        # Bez renderu per nuta: kazde zagranie otwiera kursor na buforze strefy i stroi go krokiem odczytu
+        self.playback_mode.setCurrentIndex(self.playback_mode.findData('keymap'))
+        self.sample_keymap = self.keymap
+        self.sound_store.reset(None)
+        self.sample_debug.setText(f"Sample keymap active, pitched per voice\n"
+                                  f"{len(self.keymap)} zones")
 
-            self.sample_debug.setText(f"Processed {len(self.processed_sounds)} notes\n"
-                                      f"Range: {self.min_note.value()} to {self.max_note.value()}")
-        except Exception as e:
-            self.sample_debug.setText(f"Error processing sample: {str(e)}")
+    def note_sound(self, note):
+        # Stereo int16 dla pygame powstaje z bufora mono przy kazdym zagraniu (Sound robi wlasna kopie)
+        mono = self.sound_store.get(note)
+        if mono is None:
+            return None
+        pcm = self.engine.work.get('note_pcm', (len(mono), 2), np.int16)
+        return pygame.mixer.Sound(mono_to_int16_stereo(mono, pcm))
 
     def update_volume(self):
         master_volume = self.volume_slider.value() / 100.0
-        for sound in self.processed_sounds.values():
-            sound.set_volume(master_volume)
+        self.master_volume = master_volume
+        self.stream_engine.gain = master_volume
 
     def midi_callback(self, message, time_stamp=None):
+        # Watek rtmidi: tylko znacznik czasu i wpis do bufora, bez Qt i pygame
         if not message or len(message[0]) < 3:
             return
+        data = message[0]
+        self.midi_ring.push(data[0], data[1], data[2], time.perf_counter())
 
-        status = message[0][0]
-        note = message[0][1]
-        velocity = message[0][2]
-        channel = status & 0x0F
+    def export_latency(self):
+        filename, _ = QFileDialog.getSaveFileName(self, "Export Latency", "latency.json", "JSON Files (*.json)")
+        if filename:
+            audio = {key: self.audio_config[key] for key in ('backend', 'rate', 'block', 'format')}
+            self.latency.export_json(filename, sample_rate=self.sample_rate,
+                                     block_size=self.stream_engine.block_size,
+                                     mixer_buffer=self.mixer_buffer, streaming=self.is_streaming(), audio=audio)
+            print(f"Latency exported to {filename}")
 
-        self.note_debug.setText(f"MIDI event: status={hex(status)}, channel={channel}, note={note}, velocity={velocity}")
+    def update_voice_settings(self):
+        for pool in (self.stream_engine.pool, self.channel_pool):
+            pool.max_voices = self.max_polyphony.value()
+            pool.policy = self.steal_policy.currentText()
 
-        if (0x90 <= status <= 0x9F or status == 0x98) and velocity > 0:
-            self.play_note(note, velocity)
-        elif (0x80 <= status <= 0x8F or (status == 0x98 and velocity == 0)):
-            self.stop_note(note)
+    def refresh_ui(self):
+        # Jedna migawka stanu na klatke: etykiety tylko przy zmianie tekstu, na pianorollu
+        # przemalowane tylko klawisze, ktorych stan sie zmienil
+        pool = self.stream_engine.pool if self.is_streaming() or self.sample_keymap is not None else self.channel_pool
+        voices = f"Voices: {len(pool.voices)} (peak {pool.peak}, stolen {pool.stolen})"
+        if voices != self.voice_debug.text():
+            self.voice_debug.setText(voices)
+        cache = self.render_cache
+        cache_state = (cache.hits, cache.misses, cache.evictions)
+        if cache_state != self.shown_cache_state:
+            self.shown_cache_state = cache_state
+            self.cache_debug.setText(cache.stats_text())
+        sounds = self.sound_store.stats_text()
+        if sounds != self.sound_debug.text():
+            self.sound_debug.setText(sounds)
+            self.progress.setValue(min(len(self.sound_store.entries), self.progress.maximum()))
+        underruns = self.keymap.underruns()
+        if underruns != self.shown_underruns:
+            self.shown_underruns = underruns
+            self.underrun_debug.setText(f"Disk stream underruns: {underruns}")
+        serial, held, status = self.telemetry.snapshot()
+        state = (self.midi_dispatcher.last_event, serial, self.midi_ring.dropped)
+        if state == self.shown_ui_state:
+            return
+        self.shown_ui_state = state
+        for note in np.flatnonzero(held != self.shown_keys):
+            if note in self.pianoroll_keys:
+                self.paint_key(note, held[note])
+        event, _, dropped = state
+        lines = []
+        if event is not None:
+            lines.append(f"MIDI event: status={hex(event[0])}, channel={event[0] & 0x0F}, "
+                         f"note={event[1]}, velocity={event[2]} "
+                         f"({self.midi_dispatcher.count} events, {dropped} dropped)")
+        if status is not None:
+            kind, note, detail = status
+            if kind == 'play':
+                lines.append(f"Playing note: {note} (velocity: {detail})")
+            elif kind == 'stop':
+                lines.append(f"Stopped note: {note}")
+            elif kind == 'busy':
+                lines.append("No free channels available")
+            else:
+                lines.append(f"Error with note {note}: {detail}")
+        if lines:
+            self.note_debug.setText("\n".join(lines))
 
-    def play_note(self, note, velocity):
-        if note in self.processed_sounds:
+    def play_note(self, note, velocity, timestamp=None):
+        # Wolane z dispatchera MIDI albo z GUI; stan dla etykiet i pianorolla idzie do telemetry
+        # Keymapa ma pierwszenstwo: SampleVoice i tak gra w silniku strumieniowym
+        if self.sample_keymap is not None:
+            zone = self.sample_keymap.find(note, velocity)
+            if zone is None:
+                return
+            step = zone.step(note, self.sample_rate)
+            release = self.params.get('release_time', 0.3)
+            self.stream_engine.note_on(note, velocity, timestamp, lambda note, velocity: SampleVoice(
+                note, velocity, self.sample_rate, zone.source.open(), step, release))
+            self.telemetry.note('play', note, velocity)
+        elif self.is_streaming():
+            self.stream_engine.note_on(note, velocity, timestamp)
+            self.telemetry.note('play', note, velocity)
+        elif self.sound_store.source is not None:
             try:
-                volume = (velocity / 127) * (self.volume_slider.value() / 100)
-                channel = pygame.mixer.find_channel()
-                if channel:
-                    sound = self.processed_sounds[note]
-                    sound.set_volume(volume)
-                    channel.play(sound)
-                    self.active_notes[note] = channel
-                    self.note_debug.setText(f"Playing note: {note} (velocity: {velocity})")
+                volume = (velocity / 127) * self.master_volume
+                sound = self.note_sound(note)
+                if sound is None:
+                    return
+
+                def make_voice(victim):
+                    channel = victim.channel if victim is not None else pygame.mixer.find_channel()
+                    return ChannelVoice(note, channel, sound, volume) if channel else None
+
+                self.channel_pool.reap()
+                if self.channel_pool.allocate(note, make_voice):
+                    self.telemetry.note('play', note, velocity)
+                    if timestamp is not None:
+                        # channel.play oddaje dzwiek mikserowi; wyjscie po jednym buforze miksera
+                        now = time.perf_counter()
+                        self.latency.record('voice_start', timestamp, now)
+                        self.latency.record('buffer_submit', timestamp, now)
+                        self.latency.record('output', timestamp, now + self.mixer_buffer / self.sample_rate)
                 else:
-                    self.note_debug.setText("No free channels available")
+                    self.telemetry.note('busy', note)
             except Exception as e:
-                self.note_debug.setText(f"Error playing note {note}: {str(e)}")
+                self.telemetry.note('error', note, str(e))
 
     def stop_note(self, note):
-        if note in self.active_notes:
+        if self.is_streaming() or self.sample_keymap is not None:
+            self.stream_engine.note_off(note)
+            self.telemetry.note('stop', note)
+        else:
             try:
-                channel = self.active_notes[note]
-                channel.stop()
-                del self.active_notes[note]
-                self.note_debug.setText(f"Stopped note: {note}")
+                self.channel_pool.release(note, int(self.params.get('release_time', 0.3) * 1000))
+                self.telemetry.note('stop', note)
             except Exception as e:
-                self.note_debug.setText(f"Error stopping note {note}: {str(e)}")
+                self.telemetry.note('error', note, str(e))
 
     # Wave Generator Methods
-    def custom_wave(self, t, freq):
-        # Uproszczona wersja bez custom_paramX: mieszanka sinusoidy i szumu
-        return 0.7 * np.sin(2 * np.pi * freq * t) + 0.3 * np.random.normal(0, 1, len(t))
-
     def generate_wave(self):
-        freq = self.params.get('frequency', 440.0)
-        wave1 = self.wave_shapes[self.params.get('wave_shape1', 'sine')](self.t, freq)
-        wave2 = self.wave_shapes[self.params.get('wave_shape2', 'sine')](self.t, freq)
-        wave = wave1 * (1 - self.params.get('wave_mix', 0.5)) + wave2 * self.params.get('wave_mix', 0.5)
-
-        for i in range(1, 6):
-            weight = self.params.get(f'harm{i}_weight', 1.0 / (2 ** (i - 1)))
-            wave += weight * np.sin(2 * np.pi * freq * i * self.t)
-
-        if self.params.get('freq_mod', 0.0) > 0:
-            fm = self.params['freq_mod'] * np.sin(2 * np.pi * self.params.get('freq_mod_rate', 0.0) * self.t)
-            wave = np.sin(2 * np.pi * (freq + fm) * self.t)
-        if self.params.get('amp_mod', 0.0) > 0:
-            am = 1 + self.params['amp_mod'] * np.sin(2 * np.pi * self.params.get('amp_mod_rate', 0.0) * self.t)
-            wave *= am
-
-        if self.params.get('vibrato_depth', 0.0) > 0:
-            vibrato = self.params['vibrato_depth'] * np.sin(2 * np.pi * self.params.get('vibrato_rate', 0.0) * self.t)
-            wave = np.sin(2 * np.pi * freq * self.t + vibrato)
-        if self.params.get('tremolo_depth', 0.0) > 0:
-            tremolo = 1 + self.params['tremolo_depth'] * np.sin(2 * np.pi * self.params.get('tremolo_rate', 0.0) * self.t)
-            wave *= tremolo
-        if self.params.get('noise_level', 0.0) > 0:
-            wave += np.random.normal(0, self.params['noise_level'], len(wave))
-        if self.params.get('distortion', 0.0) > 0:
-            wave = np.tanh(wave * (1 + self.params['distortion'] * 10))
-        if self.params.get('bit_crush', 0.0) > 0:
-            levels = 2 ** (16 - int(self.params['bit_crush'] * 14))
-            wave = np.round(wave * levels) / levels
-        if self.params.get('fold_amount', 0.0) > 0:
-            wave = np.sin(wave * np.pi * self.params['fold_amount'])
-        if self.params.get('filter_cutoff', 20000) < 20000:
-            b, a = signal.butter(2, self.params['filter_cutoff'] / (self.sample_rate / 2), btype='low')
-            wave = signal.filtfilt(b, a, wave)
-        if self.params.get('chorus_depth', 0.0) > 0:
-            delay = 0.03 * self.params['chorus_depth']
-            delayed_wave = np.interp(self.t - delay, self.t, wave, left=0, right=0)
-            wave += delayed_wave * self.params.get('chorus_rate', 0.0)
-
-        wave *= self.apply_adsr()
-        return wave / np.max(np.abs(wave))
+        return self.engine.generate_wave(self.params)
 
     def apply_adsr(self):
-        length = len(self.t)
-        attack_samples = int(self.params.get('attack_time', 0.1) * self.sample_rate)
-        decay_samples = int(self.params.get('decay_time', 0.2) * self.sample_rate)
-        release_samples = int(self.params.get('release_time', 0.3) * self.sample_rate)
-        total_envelope_samples = attack_samples + decay_samples + release_samples
-
-        if total_envelope_samples > length:
-            scale_factor = length / total_envelope_samples
-            attack_samples = int(attack_samples * scale_factor)
-            decay_samples = int(decay_samples * scale_factor)
-            release_samples = int(release_samples * scale_factor)
-            total_envelope_samples = attack_samples + decay_samples + release_samples
-
-        sustain_samples = max(0, length - total_envelope_samples)
-
-        attack = np.linspace(0, 1, attack_samples) if attack_samples > 0 else np.array([])
-        decay = np.linspace(1, self.params.get('sustain_level', 0.7), decay_samples) if decay_samples > 0 else np.array([])
-        sustain = np.ones(sustain_samples) * self.params.get('sustain_level', 0.7) if sustain_samples > 0 else np.array([])
-        release = np.linspace(self.params.get('sustain_level', 0.7), 0, release_samples) if release_samples > 0 else np.array([])
-
-        envelope = np.concatenate([attack, decay, sustain, release])
-        if len(envelope) < length:
-            envelope = np.pad(envelope, (0, length - len(envelope)), mode='constant')
-        elif len(envelope) > length:
-            envelope = envelope[:length]
-
-        return envelope
+        return self.engine.apply_adsr(self.params)
 
     def update_param(self, param, value):
-        scale = 1.0 if 'freq' in param or 'rate' in param else 0.01 if any(x in param for x in ['time', 'depth', 'level', 'mix', 'amount']) else 1.0
+        scale = 0.01 if param == 'chorus_rate' else 1.0 if 'freq' in param or 'rate' in param else 0.01 if any(x in param for x in ['time', 'depth', 'level', 'mix', 'amount', 'resonance']) else 1.0
         self.params[param] = value * scale
         self.update_waveform()
 
+    def update_filter_mode(self, mode):
+        self.params['filter_mode'] = mode
+        self.update_waveform()
+
     def update_wave_shape1(self, shape):
         self.params['wave_shape1'] = shape
         self.update_waveform()
@@ -672,24 +4006,38 @@ class WavInstrumentApp(QMainWindow):
         self.update_waveform()
 
     def randomize_params(self):
-        for param in self.params:
-            if param in ['wave_shape1', 'wave_shape2']:
-                self.params[param] = random.choice(list(self.wave_shapes.keys()))
-            else:
-                max_val = 1.0 if any(x in param for x in ['weight', 'level', 'depth', 'mix', 'amount']) else \
-                          2.0 if 'time' in param else 2000 if 'freq' in param or 'rate' in param else 1.0
-                self.params[param] = random.uniform(0, max_val)
-                if param in self.sliders:
-                    scale = 100 if any(x in param for x in ['weight', 'level', 'depth', 'mix', 'amount']) else \
-                            100 if 'time' in param else 1
-                    self.sliders[param].setValue(int(self.params[param] * scale))
+        patch = random_patch(shapes=tuple(self.wave_shapes))
+        self.params.update((param, patch[param]) for param in self.params if param in patch)
+        self.sync_controls()
         self.update_waveform()
 
+    def sync_controls(self):
+        self.filter_mode_combo.setCurrentText(self.params.get('filter_mode', 'lowpass'))
+        for param, value in self.params.items():
+            if param in self.sliders:
+                scale = 100 if any(x in param for x in ['weight', 'level', 'depth', 'mix', 'amount', 'resonance']) else \
+                        100 if 'time' in param or param == 'chorus_rate' else 1
+                self.sliders[param].setValue(int(value * scale))
+
     def update_preset_lists(self):
-        self.preset_combo.clear()
-        self.preset_combo.addItems(self.presets.keys())
-        self.main_preset_combo.clear()
-        self.main_preset_combo.addItems(self.presets.keys())
+        # Oba comboboksy dziela jeden model; dokladamy i usuwamy tylko roznice
+        names = self.presets.names()
+        current = self.preset_model.stringList()
+        if not current:
+            self.preset_model.setStringList(names)
+        elif names != current:
+            keep = set(names)
+            for row in reversed(range(len(current))):
+                if current[row] not in keep:
+                    self.preset_model.removeRows(row, 1)
+                    del current[row]
+            have = set(current)
+            for name in names:
+                if name not in have:
+                    row = bisect.bisect_left(current, name)
+                    self.preset_model.insertRows(row, 1)
+                    self.preset_model.setData(self.preset_model.index(row), name)
+                    current.insert(row, name)
         if self.current_preset_name in self.presets:
             self.preset_combo.setCurrentText(self.current_preset_name)
             self.main_preset_combo.setCurrentText(self.current_preset_name)
@@ -697,13 +4045,9 @@ class WavInstrumentApp(QMainWindow):
     def save_preset(self):
         name = self.preset_name_edit.text()
         if name:
-            self.presets[name] = self.params.copy()
+            self.presets.save(name, self.params.copy())
             self.current_preset_name = name
             self.update_preset_lists()
-            preset_dir = "presets"
-            os.makedirs(preset_dir, exist_ok=True)
-            with open(os.path.join(preset_dir, f"{name}.json"), 'w') as f:
-                json.dump(self.params, f, indent=4)
 
     def load_preset(self, name):
         if name in self.presets and not self.updating_waveform:
@@ -713,68 +4057,128 @@ class WavInstrumentApp(QMainWindow):
             self.params.setdefault('wave_shape1', 'sine')
             self.params.setdefault('wave_shape2', 'sine')
             self.params.setdefault('frequency', 440.0)
-            for param, value in self.params.items():
-                if param in self.sliders:
-                    scale = 100 if any(x in param for x in ['weight', 'level', 'depth', 'mix', 'amount']) else \
-                            100 if 'time' in param else 1
-                    self.sliders[param].setValue(int(value * scale))
+            self.params.setdefault('filter_mode', 'lowpass')
+            self.params.setdefault('chorus_mix', 0.5)
+            self.sync_controls()
             self.update_waveform()
             self.update_preset_lists()
             self.updating_waveform = False
 
+    def find_similar(self, random_patches=0):
+        # Indeks cech aktualizowany i przeszukiwany w watku w tle; wynik wraca sygnalem similar_ready
+        if self.similar_busy:
+            return
+        self.similar_busy = True
+        self.similar_list.clear()
+        self.similar_list.addItem("Analyzing...")
+        params = dict(self.params)
+        exclude = self.current_preset_name
+        threading.Thread(target=self._find_similar, args=(params, exclude, random_patches),
+                         name="similar", daemon=True).start()
+
+    def _find_similar(self, params, exclude, random_patches):
+        try:
+            start = time.perf_counter()
+            if self.feature_index is None:
+                self.feature_index = FeatureIndex(self.presets.directory)
+            index = self.feature_index
+            changed, _ = index.update(self.presets)
+            if random_patches:
+                seed = len(index.patches)
+                rng = random.Random(seed)
+                index.add_patches({f"random_{seed + i:05d}": random_patch(rng) for i in range(random_patches)})
+            if changed or random_patches:
+                index.save()
+            analyzed = time.perf_counter()
+            results = index.similar_to(params, 10, exclude)
+            self.similar_ready.emit((results, len(index), analyzed - start, time.perf_counter() - analyzed))
+        except Exception as e:
+            self.similar_ready.emit(e)
+
+    def show_similar(self, result):
+        self.similar_busy = False
+        self.similar_list.clear()
+        if isinstance(result, Exception):
+            self.similar_list.addItem(f"Error: {str(result)}")
+            return
+        results, size, update_time, query_time = result
+        for name, distance in results:
+            self.similar_list.addItem(f"{name}  ({distance:.3f})")
+        self.debug_label.setText(f"Similar patches from {size} indexed: update {update_time * 1000:.0f} ms, "
+                                 f"search {query_time * 1000:.1f} ms")
+
+    def load_similar(self, item):
+        name = item.text().rsplit("  (", 1)[0]
+        if name in self.presets:
+            self.preset_combo.setCurrentText(name)
+        elif self.feature_index is not None and name in self.feature_index:
+            # Losowy patch nie ma pliku; mozna go zapisac jak zwykly preset przez Save Preset
+            self.params = dict(DEFAULT_PARAMS, **self.feature_index.patches[name])
+            self.preset_name_edit.setText(name)
+            self.sync_controls()
+            self.update_waveform()
+
     def load_presets_from_directory(self):
-        preset_dir = "presets"
-        if os.path.exists(preset_dir):
-            for filename in os.listdir(preset_dir):
-                if filename.endswith(".json"):
-                    try:
-                        with open(os.path.join(preset_dir, filename), 'r') as f:
-                            preset_name = os.path.splitext(filename)[0]
-                            self.presets[preset_name] = json.load(f)
-                    except Exception as e:
-                        print(f"Error loading preset {filename}: {str(e)}")
+        self.presets.scan()
         self.update_preset_lists()
 
+    def scan_presets_in_background(self):
+        if self.preset_scan_busy:
+            return
+        self.preset_scan_busy = True
+        threading.Thread(target=self._stat_presets, name="preset-scan", daemon=True).start()
+
+    def _stat_presets(self):
+        try:
+            self.presets_scanned.emit(self.presets.stat_files())
+        except Exception as e:
+            print(f"Error scanning presets: {str(e)}")
+            self.presets_scanned.emit(None)
+
+    def apply_preset_scan(self, files):
+        self.preset_scan_busy = False
+        if files is None:
+            return
+        changed, removed = self.presets.scan(files)
+        if changed or removed:
+            self.update_preset_lists()
+
     def export_presets(self):
         filename, _ = QFileDialog.getSaveFileName(self, "Export Presets", "", "JSON Files (*.json)")
         if filename:
-            with open(filename, 'w') as f:
-                json.dump(self.presets, f, indent=4)
+            self.presets.export_file(filename)
             print(f"Presets exported to {filename}")
 
     def import_presets(self):
         filename, _ = QFileDialog.getOpenFileName(self, "Import Presets", "", "JSON Files (*.json)")
         if filename:
-            with open(filename, 'r') as f:
-                self.presets.update(json.load(f))
+            self.presets.import_file(filename)
             self.update_preset_lists()
             print(f"Presets imported from {filename}")
 
     def update_waveform(self):
+        # Serie zmian suwakow sklejamy w jedno zlecenie podgladu po 30 ms ciszy
         if self.updating_waveform:
             return
-        self.updating_waveform = True
-        wave = self.generate_wave()
-        self.wave_scene.clear()
+        self.preview_timer.start()
+
+    def update_scope_zoom(self):
+        self.preview_renderer.length = self.scope_zoom.currentData()
+        self.update_waveform()
+
+    def draw_waveform(self, samples):
+        if self.pending_preview_key is not None:
+            if self.pending_preview_key == self.preview_key():
+                self.render_cache.put(self.pending_preview_key, mono_to_int16(np.asarray(samples, dtype=np.float32)))
+            self.pending_preview_key = None
         width = self.wave_view.width()
         height = 150
-        samples = wave[:min(2000, len(wave))]
-        step = width / len(samples)
-
-        self.wave_scene.addLine(0, height / 2, width, height / 2, QPen(Qt.GlobalColor.gray))
-        self.wave_scene.addLine(0, 0, 0, height, QPen(Qt.GlobalColor.gray))
 
+        self.wave_axis.setLine(0, height / 2, width, height / 2)
         path = QPainterPath()
-        path.moveTo(0, height / 2)
-        for i, sample in enumerate(samples):
-            x = i * step
-            y = height / 2 - (sample * height / 2)
-            path.lineTo(x, y)
-        self.wave_scene.addPath(path, QPen(Qt.GlobalColor.blue, 1))
-
-        self.play_line = self.wave_scene.addLine(0, 0, 0, height, QPen(Qt.GlobalColor.red, 2))
+        path.addPolygon(polygon_from_array(scope_points(samples, width, height)))
+        self.wave_path.setPath(path)
         self.wave_view.setSceneRect(0, 0, width, height)
-        self.updating_waveform = False
 
     def update_play_position(self):
         if self.is_looping:
@@ -786,8 +4190,7 @@ class WavInstrumentApp(QMainWindow):
 
     def play_sound(self):
         wave = self.generate_wave()
-        wave_stereo = np.vstack((wave, wave)).T.astype(np.float32)
-        wave_int16 = np.int16(wave_stereo * 32767).copy(order='C')
+        wave_int16 = mono_to_int16_stereo(wave)
         self.sound = pygame.mixer.Sound(wave_int16)
         self.sound.play()
 
@@ -805,8 +4208,7 @@ class WavInstrumentApp(QMainWindow):
 
     def start_loop(self):
         wave = self.generate_wave()
-        wave_stereo = np.vstack((wave, wave)).T.astype(np.float32)
-        wave_int16 = np.int16(wave_stereo * 32767).copy(order='C')
+        wave_int16 = mono_to_int16_stereo(wave)
         self.sound = pygame.mixer.Sound(wave_int16)
         self.sound.play(-1)
 
@@ -814,10 +4216,36 @@ class WavInstrumentApp(QMainWindow):
         if self.sound:
             self.sound.stop()
 
+    def bounce_midi_file(self, midi_path=None):
+        if not midi_path:
+            midi_path, _ = QFileDialog.getOpenFileName(self, "Bounce MIDI File", "", "MIDI Files (*.mid *.midi);;All Files (*)")
+        if not midi_path:
+            return
+        # Probki z keymapy, gdy jest aktywna, w przeciwnym razie biezace params syntezatora
+        out_path = os.path.splitext(midi_path)[0] + ".wav"
+        self.bounce_button.setEnabled(False)
+        self.debug_label.setText(f"Bouncing {os.path.basename(midi_path)}...")
+        threading.Thread(target=self._bounce, args=(midi_path, out_path, dict(self.params), self.sample_keymap),
+                         name="bounce", daemon=True).start()
+
+    def _bounce(self, midi_path, out_path, params, keymap):
+        try:
+            self.bounce_ready.emit((out_path,) + bounce_midi(midi_path, out_path, params, self.sample_rate, keymap=keymap))
+        except Exception as e:
+            self.bounce_ready.emit(e)
+
+    def show_bounce_result(self, result):
+        self.bounce_button.setEnabled(True)
+        if isinstance(result, Exception):
+            self.debug_label.setText(f"Error bouncing MIDI file: {str(result)}")
+            return
+        out_path, seconds, elapsed, parts = result
+        self.debug_label.setText(f"Bounced {parts} parts to {os.path.basename(out_path)}: {seconds:.1f} s of audio "
+                                 f"in {elapsed:.2f} s ({seconds / max(elapsed, 1e-9):.1f}x real time)")
+
     def save_wave(self):
         wave = self.generate_wave()
-        wave_stereo = np.vstack((wave, wave)).T.astype(np.float32)
-        wave_int16 = np.int16(wave_stereo * 32767).copy(order='C')
+        wave_int16 = mono_to_int16_stereo(wave)
         filename = f"custom_wave_{self.params.get('frequency', 440.0)}Hz.wav"
         wavfile.write(filename, self.sample_rate, wave_int16)
         print(f"Saved to {filename}")
@@ -825,13 +4253,83 @@ class WavInstrumentApp(QMainWindow):
     def closeEvent(self, event):
         if self.midi_in:
             self.midi_in.close_port()
-        pygame.mixer.quit()
+        self.midi_dispatcher.stop()
+        if self.audio_device:
+            self.audio_device.close()
+        if pygame.mixer.get_init():
+            pygame.mixer.quit()
         event.accept()
 
 def main():
-    app = QApplication(sys.argv)
-    window = WavInstrumentApp()
-    window.show()
+    parser = argparse.ArgumentParser(description="WAV MIDI Instrument with Wave Generator")
+    parser.add_argument('--bench', action='store_true', help="run the DSP/render benchmark suite and exit")
+    parser.add_argument('--quick', action='store_true', help="fewer repeats and sizes for --bench")
+    parser.add_argument('--memory', action='store_true', help="add a tracemalloc peak-memory report to --bench")
+    parser.add_argument('--save-baseline', metavar='FILE', help="write --bench results as a baseline JSON")
+    parser.add_argument('--compare', metavar='FILE', help="fail if --bench is slower than this baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown for --compare (0.25 = 25%%)")
+    parser.add_argument('--bench-pool', action='store_true', help="benchmark process pool scaling and exit")
+    parser.add_argument('--render-presets', metavar='DIR', help="render every preset in DIR to WAV and exit")
+    parser.add_argument('--notes', type=parse_note_range, default=(36, 84), help="note range, e.g. 36-84")
+    parser.add_argument('--out', default="rendered", help="output directory for --render-presets")
+    parser.add_argument('--tag', help="only presets with this index tag for --render-presets, e.g. chorus or square")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--startup-report', action='store_true', help="print per-phase startup times and exit")
+    parser.add_argument('--index-features', metavar='DIR', help="update the spectral feature index of presets in DIR and exit")
+    parser.add_argument('--random-patches', type=int, default=0, help="random patches to add to --index-features")
+    parser.add_argument('--similar', metavar='NAME', help="with --index-features: list patches that sound like NAME")
+    parser.add_argument('--neighbours', type=int, default=10, help="result count for --similar")
+    parser.add_argument('--bounce', metavar='MIDI', help="render a Standard MIDI File to WAV and exit")
+    parser.add_argument('--bounce-out', metavar='FILE', help="output WAV for --bounce (default: MIDI name with .wav)")
+    parser.add_argument('--preset', metavar='NAME', help="preset from ./presets used by --bounce and --load-test")
+    parser.add_argument('--audio', choices=AUDIO_BACKENDS, default=AUDIO_DEFAULTS['backend'],
+                        help="audio output: sound device, null sink (timing only) or WAV file")
+    parser.add_argument('--rate', type=int, default=AUDIO_DEFAULTS['rate'], help="output sample rate")
+    parser.add_argument('--block', type=int, default=AUDIO_DEFAULTS['block'], help="frames per audio block")
+    parser.add_argument('--format', choices=tuple(SAMPLE_FORMATS), default=AUDIO_DEFAULTS['format'],
+                        help="output sample format")
+    parser.add_argument('--audio-file', default=AUDIO_DEFAULTS['path'], help="output WAV for --audio file")
+    parser.add_argument('--load-test', type=float, metavar='SECONDS',
+                        help="render SECONDS of held voices through the null (or --audio file) sink and print block timing")
+    parser.add_argument('--voices', type=int, default=16, help="held voices for --load-test")
+    args, qt_args = parser.parse_known_args()
+    if args.render_presets:
+        render_library(args.render_presets, args.out, args.notes, args.workers, tag=args.tag)
+        return
+    if args.index_features:
+        feature_main(args)
+        return
+    if args.load_test:
+        run_load_test(args)
+        return
+    if args.bounce:
+        params = dict(DEFAULT_PARAMS)
+        if args.preset:
+            store = PresetStore()
+            store.scan()
+            params.update(store[args.preset])
+        out_path = args.bounce_out or os.path.splitext(args.bounce)[0] + ".wav"
+        seconds, elapsed, parts = bounce_midi(args.bounce, out_path, params, workers=args.workers)
+        print(f"Bounced {parts} parts, {seconds:.1f} s of audio in {elapsed:.2f} s "
+              f"({seconds / max(elapsed, 1e-9):.1f}x real time) to {out_path}")
+        return
+    if args.bench:
+        bench_main(args)
+        return
+    if args.bench_pool:
+        benchmark_sample_pool()
+        return
+    STARTUP.add("module import", STARTUP.origin)
+    with STARTUP.phase("QApplication"):
+        app = QApplication(sys.argv[:1] + qt_args)
+    with STARTUP.phase("window init"):
+        window = WavInstrumentApp(exit_after_startup=args.startup_report,
+                                  audio={'backend': args.audio, 'rate': args.rate, 'block': args.block,
+                                         'format': args.format, 'path': args.audio_file})
+    with STARTUP.phase("window show"):
+        window.show()
+    started = time.perf_counter()
+    QTimer.singleShot(0, lambda: STARTUP.add("first event loop pass", started))
     sys.exit(app.exec())
 
 if __name__ == "__main__":